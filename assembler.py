@@ -2,74 +2,544 @@
 # - because Computer Systems doesn't fix their own assembler
 #
 # Made in 2018 by Luke Serné
+import contextlib
+import functools
+import io
+import itertools
+import json
+import mmap
+import os
 import re
+import shutil
+import sys
+import tempfile
 import typing
 
 import base
+import hooks
+import ir
 import parser
+import relaxation
+import stats
+
+# cache and parallel are only imported when they are used, since most runs
+# don't need them and they take a while to import
+if typing.TYPE_CHECKING:
+    import cache
+
+# Format strings for a line of code, by the number of words of the instruction
+_CODE_LINE_FORMATS = {1: "%05x\n", 2: "%05x %05x\n"}
+
+# The number of instructions or data words that are formatted at once
+_CHUNK_SIZE = 4096
+
+_WRITE_BUFFER_SIZE = 1 << 16
+
+# The error for an alias that is assigned to after it is used, in one-pass mode
+# (see Assembler.iter_windows)
+_REDEFINED_MESSAGE = "%s is redefined after it is used, which is not supported when assembling in a single pass"
+
+# Reserves the space for the header of the code segment, while streaming
+_CODE_HEADER_PLACEHOLDER = "@C 00000 00000\n"
 
 class Segment:
     address: typing.Optional[int] = None
     size: int = 0
-    entries: typing.Union[list[list[int]], list[int], type(None)] = None
+    entries: typing.Union[list[tuple[int, ...]], list[tuple[int, int]], type(None)] = None
+
+    # The resolved instructions of a code segment, in the same order as the
+    # entries. Only kept if a listing is requested.
+    instructions: typing.Optional[list[ir.Instruction]] = None
 
     def __init__(self):
         self.entries = []
 
+    def add_run(self, value: int, count: int):
+        """
+        Appends count copies of value to a data segment. The entries of a data
+        segment are (value, count) runs, so large blocks take constant space.
+        """
+        if self.entries and self.entries[-1][0] == value:
+            self.entries[-1] = (value, self.entries[-1][1] + count)
+        else:
+            self.entries.append((value, count))
+
+        self.size += count
+
+def write_code_lines(entries: list[tuple[int, ...]], f: typing.TextIO):
+    """
+    Writes the encoded instructions of a code segment to a text stream, a line
+    per instruction.
+    """
+    for start in range(0, len(entries), _CHUNK_SIZE):
+        chunk = entries[start:start + _CHUNK_SIZE]
+        line_formats = "".join([_CODE_LINE_FORMATS[len(instruction)] for instruction in chunk])
+
+        f.write(line_formats % tuple(itertools.chain.from_iterable(chunk)))
+
+def create_segments() -> tuple[Segment, Segment, Segment]:
+    """
+    Returns empty code, data and stack segments.
+    """
+    data = Segment()
+    code = Segment()
+    stack = Segment()
+
+    # TODO: Don't hardcode the stack address and size
+    stack.address = 0x3ffff
+    stack.size = 0xf0
+
+    return code, data, stack
+
+class Image:
+    """
+    The result of an assembly: the code, data and stack segments.
+    """
+    def __init__(self, code: Segment, data: Segment, stack: Segment):
+        self.code = code
+        self.data = data
+        self.stack = stack
+
+    def to_hex(self) -> str:
+        """
+        Returns the image in the hex format.
+        """
+        f = io.StringIO()
+        self.write_to(f)
+
+        return f.getvalue()
+
+    def write_to(self, f: typing.TextIO):
+        """
+        Writes the image in the hex format to a text stream. The words are
+        formatted a chunk at a time, with a single '%' operation per chunk.
+        """
+        # First code
+        f.write(self.code_header())
+        write_code_lines(self.code.entries, f)
+
+        self.write_tail(f)
+
+    def code_header(self) -> str:
+        return f"@C {self.code.address:05x} {self.code.size:05x}\n"
+
+    def write_tail(self, f: typing.TextIO):
+        """
+        Writes everything after the lines of the code segment.
+        """
+        f.write("\n")
+
+        # Then data (optional)
+        if self.data.address is not None:
+            f.write(f"@D {self.data.address:05x} {self.data.size:05x}\n")
+
+            # All words go on a single line, separated by spaces. Every word is
+            # written with a leading space, except for the very first one.
+            pieces = []
+            pieces_size = 0
+            skip = 1
+
+            for value, count in self.data.entries:
+                word = f" {value:05x}"
+
+                while count > 0:
+                    n = min(count, _CHUNK_SIZE)
+                    pieces.append(word * n)
+                    pieces_size += n
+                    count -= n
+
+                    if pieces_size >= _CHUNK_SIZE:
+                        f.write("".join(pieces)[skip:])
+                        pieces.clear()
+                        pieces_size = 0
+                        skip = 0
+
+            f.write("".join(pieces)[skip:])
+
+            f.write("\n\n")
+
+        # Then stack (optional)
+        if self.stack.address is not None:
+            f.write(f"@S {self.stack.address:05x} {self.stack.size:05x}\n")
+
+            f.write("\n")
+
+        # Then end
+        f.write(".\n")
+
 class Assembler:
-    def __init__(self, input_, output_, verbose_):
+    def __init__(self, input_, output_, verbose_, one_pass_=False, listing_=None, stats_=None):
         self.input = input_
         self.output = output_
         self.verbose = verbose_
+        self.one_pass = one_pass_
+        self.listing = listing_  # file name for the listing, or None
+        self.stats: typing.Optional[stats.Stats] = stats_  # None to measure nothing
+        self.hooks: list[hooks.Hooks] = []
+
+        # Whether to use the (process wide) cache of encodings, see
+        # cached_encoding
+        self.cache_encodings = True
+
+        # The on-disk cache of assembled files, or None to always assemble
+        self.cache: typing.Optional["cache.BuildCache"] = None
+
+        # The number of processes to parse with (see parallel.parse), or None
+        # to parse in this process. Not used in one-pass mode.
+        self.parse_jobs: typing.Optional[int] = None
+
+        # Whether to memory map the input file instead of reading it, so that
+        # (in one-pass mode) memory use doesn't grow with the size of the
+        # source. Parsing in several processes needs the input in memory, so
+        # parse_jobs is ignored for memory mapped input.
+        self.memory_map = False
+
+        # Whether to write the output while assembling, instead of assembling
+        # everything first (see stream_source). Implies one-pass assembly.
+        self.streaming = False
+
+        # The parser of the last assembled source
+        self.parser: typing.Optional[parser.Parser] = None
 
     def assemble(self):
+        if self.memory_map:
+            with open(self.input, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    # Empty files can't be mapped
+                    self.assemble_content(b"")
+                    return
+
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+                    try:
+                        self.assemble_content(content)
+                    finally:
+                        if self.parser is not None:
+                            self.parser.lexer.close()
+            return
+
         # read input file
-        with open(self.input, 'r') as f:
-            content = f.read()
+        with self.phase("read"):
+            with open(self.input, 'r') as f:
+                content = f.read()
+
+        self.assemble_content(content)
+
+    def assemble_content(self, content: typing.Union[str, bytes, mmap.mmap]):
+        """
+        Assembles the content of the input file to the output (and listing)
+        files.
+        """
+        if self.cache is not None:
+            with self.phase("cache"):
+                key = self.cache.key(content, parser.find_includes(content, self.input))
+                entry = self.cache.lookup(key, self.wants_listing())
+
+            if entry is not None:
+                self.count("cache_hits")
+                self.copy_cached(entry)
+                return
+
+            self.count("cache_misses")
+
+        if self.streaming:
+            listing = self.stream_to_files(content, self.cache is not None)
+
+            if self.cache is not None:
+                with self.phase("cache"):
+                    self.cache.store(key, self.output, listing, self.stats_json())
+
+            return
+
+        image = self.assemble_source(content)
+
+        with self.phase("write"):
+            self.write_output(image.code, image.data, image.stack, self.output)
+
+        if self.cache is not None:
+            # Keep the listing in memory, so it can be cached as well
+            listing = None
+
+            if self.wants_listing():
+                f = io.StringIO()
+                self.write_listing(image.code, f)
+                listing = f.getvalue()
+
+                self.write_cached_listing(listing)
+
+            with self.phase("cache"):
+                self.cache.store(key, self.output, listing, self.stats_json())
+
+            return
+
+        if self.verbose:
+            self.write_listing(image.code, sys.stdout)
+
+        if self.listing is not None:
+            with self.phase("listing"):
+                with open(self.listing, "w", buffering=_WRITE_BUFFER_SIZE) as f:
+                    self.write_listing(image.code, f)
+
+    def stream_to_files(self, content: typing.Union[str, bytes, mmap.mmap], keep_listing: bool = False) -> typing.Optional[str]:
+        """
+        Assembles the content of the input file to the output (and listing)
+        files with stream_source. If keep_listing is set, the listing is kept in
+        memory and returned as well. The output file is removed if assembling
+        fails.
+        """
+        listing_buffer = None
 
+        with contextlib.ExitStack() as files:
+            listings = []
+
+            if self.wants_listing():
+                if keep_listing:
+                    listing_buffer = io.StringIO()
+                    listings.append(listing_buffer)
+                else:
+                    if self.verbose:
+                        listings.append(sys.stdout)
+
+                    if self.listing is not None:
+                        listings.append(files.enter_context(open(self.listing, "w", buffering=_WRITE_BUFFER_SIZE)))
+
+            f = files.enter_context(open(self.output, "w", buffering=_WRITE_BUFFER_SIZE))
+
+            try:
+                self.stream_source(content, f, listings)
+            except BaseException:
+                f.close()
+                os.remove(self.output)
+                raise
+
+        if listing_buffer is None:
+            return None
+
+        listing = listing_buffer.getvalue()
+        self.write_cached_listing(listing)
+
+        return listing
+
+    def copy_cached(self, entry: "cache.CacheEntry"):
+        """
+        Copies the files of a cache entry to the output (and listing) files.
+        """
+        with self.phase("write"):
+            shutil.copyfile(entry.hex_path, self.output)
+
+        if entry.listing_path is not None:
+            with open(entry.listing_path, 'r') as f:
+                self.write_cached_listing(f.read())
+
+        if self.stats is not None and entry.stats_path is not None:
+            with open(entry.stats_path, 'r') as f:
+                self.stats.cached_build = json.load(f)
+
+    def stats_json(self) -> typing.Optional[str]:
+        """
+        Returns the stats of the build so far as JSON, to store them with a
+        cache entry, or None if nothing is measured.
+        """
+        if self.stats is None:
+            return None
+
+        return self.stats.to_json()
+
+    def write_cached_listing(self, listing: str):
+        """
+        Writes a listing that is already formatted to the console (if verbose)
+        and to the listing file (if any).
+        """
+        if self.verbose:
+            sys.stdout.write(listing)
+
+        if self.listing is not None:
+            with self.phase("listing"):
+                with open(self.listing, "w") as f:
+                    f.write(listing)
+
+    def assemble_source(self, source: typing.Union[str, bytes, mmap.mmap]) -> Image:
+        """
+        Assembles source code that is already in memory, or UTF-8 encoded
+        bytes (which may be memory mapped). The output file names of the
+        assembler are not used. Included files are relative to the input file
+        (or to the working directory, if there is none).
+        """
         # parse input
-        self.parser = parser.Parser(content)
+        self.parser = parser.Parser(source, path=self.input)
 
-        # parses the code and data sections - tokenises everything, removes
-        # comments, gets the aliases and initialises the data
-        tokens, aliases = self.parser.parseSections()
+        if self.one_pass:
+            # assemble the tokens while they are being parsed, so parsing and
+            # assembling are measured as a single phase
+            with self.phase("assemble"):
+                aliases = parser.AliasLog()
+                tokens = self.parser.iter_sections(aliases)
 
-        code, data, stack = self.assemble_2(tokens, aliases)
+                code, data, stack = self.assemble_one_pass(tokens, aliases)
+        else:
+            # parses the code and data sections - tokenises everything, removes
+            # comments, gets the aliases and initialises the data
+            with self.phase("parse"):
+                if self.parse_jobs is None or not isinstance(source, str):
+                    tokens, aliases = self.parser.parseSections()
+                else:
+                    import parallel
+                    tokens, aliases = parallel.parse(source, self.parse_jobs, self.input)
 
-        self.write_output(code, data, stack, self.output)
+            code, data, stack = self.assemble_2(tokens, aliases)
 
-    def write_output(self, code: Segment, data: Segment, stack: Segment, output_filename: str):
+        return Image(code, data, stack)
+
+    def stream_source(self, source: typing.Union[str, bytes, mmap.mmap], f: typing.TextIO, listings: typing.Sequence[typing.TextIO] = ()):
         """
-        Writes everything to a hex file.
+        Assembles source code to the hex format in a text stream, in a single
+        pass (see iter_windows). The instructions are encoded and written (and
+        listed to the listing streams) a chunk at a time, so neither the tokens
+        nor the code segment are ever in memory as a whole.
+
+        The header of the code segment contains its size, so it is written last:
+        over a placeholder if the stream is seekable, or else in front of the
+        code, which is then spooled to a temporary file first.
         """
-        with open(output_filename, "w") as f:
-            # First code
-            f.write(f"@C {code.address:05x} {code.size:05x}\n")
+        self.parser = parser.Parser(source, path=self.input)
+        aliases = parser.AliasLog()
 
-            for instruction in code.entries:
-                f.write(" ".join(f"{entry:05x}" for entry in instruction))
-                f.write("\n")
+        code, data, stack = create_segments()
 
-            f.write("\n")
+        if listings:
+            code.instructions = []
 
-            # Then data (optional)
-            if data.address is None:
-                f.write(f"@D {data.address:05x} {data.size:05x}\n")
+        with contextlib.ExitStack() as files:
+            if f.seekable():
+                header_position = f.tell()
+                f.write(_CODE_HEADER_PLACEHOLDER)
+                out = f
+            else:
+                out = files.enter_context(tempfile.TemporaryFile("w+"))
+
+            def flush():
+                write_code_lines(code.entries, out)
+
+                for listing in listings:
+                    self.write_listing(code, listing)
+
+                code.entries.clear()
+
+                if code.instructions is not None:
+                    code.instructions.clear()
+
+            with self.phase("assemble"):
+                tokens = self.parser.iter_sections(aliases)
+
+                for window in self.iter_windows(tokens, aliases, code, data):
+                    self.encode_instructions(window, code)
+
+                    if len(code.entries) >= _CHUNK_SIZE:
+                        flush()
+
+                flush()
+
+                image = Image(code, data, stack)
+                header = image.code_header()
+
+                if out is f:
+                    if len(header) != len(_CODE_HEADER_PLACEHOLDER):
+                        raise ValueError("Code segment does not fit in the address space")
+
+                    end_position = f.tell()
+                    f.seek(header_position)
+                    f.write(header)
+                    f.seek(end_position)
+                else:
+                    f.write(header)
+                    out.seek(0)
+                    shutil.copyfileobj(out, f)
+
+                image.write_tail(f)
+
+    def add_hook(self, hook: hooks.Hooks):
+        """
+        Registers an observer of the assembly.
+        """
+        self.hooks.append(hook)
+
+    def phase(self, name: str) -> typing.ContextManager:
+        """
+        Returns a context manager around a phase of the assembly, that measures
+        it (if statistics are collected) and notifies the hooks.
+        """
+        if not self.hooks:
+            if self.stats is None:
+                return contextlib.nullcontext()
 
-                f.write(" ".join(f"{word:05x}" for (_, word) in data.entries))
+            return self.stats.phase(name)
 
-                f.write("\n\n")
+        return self._hooked_phase(name)
 
-            # Then stack (optional)
-            if stack.address is None:
-                f.write(f"@S {stack.address:05x} {stack.size:05x}\n")
+    @contextlib.contextmanager
+    def _hooked_phase(self, name: str) -> typing.Iterator[None]:
+        for hook in self.hooks:
+            hook.phase_start(name)
 
-                f.write("\n")
+        try:
+            if self.stats is None:
+                yield
+            else:
+                with self.stats.phase(name):
+                    yield
+        finally:
+            for hook in self.hooks:
+                hook.phase_end(name)
 
-            # Then end
-            f.write(".\n")
+    def count(self, name: str, n: int = 1):
+        """
+        Adds n to a counter, if statistics are collected.
+        """
+        if self.stats is not None:
+            self.stats.count(name, n)
 
-    def assemble_2(self, tokens: list, aliases: list) -> tuple:
+    def wants_listing(self) -> bool:
+        """
+        Returns whether the resolved instructions must be kept for a listing.
+        """
+        return self.verbose or self.listing is not None
+
+    def write_listing(self, code: Segment, f: typing.TextIO):
+        """
+        Writes a listing of the code segment (address, encoding and decoded
+        instruction per line) to a text stream. The code segment must have been
+        assembled with a listing requested.
+        """
+        if code.instructions is None:
+            raise ValueError("No listing was requested for this code segment")
+
+        for start in range(0, len(code.entries), _CHUNK_SIZE):
+            lines = []
+
+            for instruction, encoding in zip(code.instructions[start:start + _CHUNK_SIZE], code.entries[start:start + _CHUNK_SIZE]):
+                # TODO: Deduce mnemonic and operands from encoding
+                if len(encoding) == 2:
+                    encoding_str = f"{encoding[0]:05x} {encoding[1]:05x}"
+                else:
+                    encoding_str = f"{encoding[0]:05x} {'':5}"
+
+                lines.append(f"{instruction.address:05x} {encoding_str} {instruction.mnemonic:5} {self.operands_to_str(instruction.operands)}\n")
+
+            f.write("".join(lines))
+
+    def write_output(self, code: Segment, data: Segment, stack: Segment, output_filename: str):
+        """
+        Writes everything to a hex file.
+        """
+        with open(output_filename, "w", buffering=_WRITE_BUFFER_SIZE) as f:
+            self.write_hex(code, data, stack, f)
+
+    def write_hex(self, code: Segment, data: Segment, stack: Segment, f: typing.TextIO):
+        """
+        Writes everything in the hex format to a text stream.
+        """
+        Image(code, data, stack).write_to(f)
+
+    def assemble_2(self, tokens: list, aliases: list, keep_tokens: bool = False) -> tuple:
         """
         Assembles the tokens into more numbers and splits it up into code, data
         and stack. Also converts everything into segments.
@@ -77,227 +547,473 @@ class Assembler:
         - CODE: Resolves label references, calculates shortest length.
         - DATA: Calculates length
         - STACK: Default (address: 0x3ffff, size: 0xf0)
+
+        With keep_tokens, the operands of the instructions are left alone, so
+        the tokens can be assembled again (see resolved_instructions).
         """
         # TODO: Split this function into multiple shorter funtions
 
         # Create the three segments
-        data = Segment()
-        code = Segment()
-        stack = Segment()
+        code, data, stack = create_segments()
 
-        # TODO: Don't hardcode the stack address and size
-        stack.address = 0x3ffff
-        stack.size = 0xf0
+        if self.wants_listing():
+            code.instructions = []
 
         # Resolve label addresses
         address = 0
-        long_form_tokens = []
-        all_tokens = []  # code and data tokens - type: list[tuple[int, Token]]
+        long_form_instructions = []
+        instructions = []
+        label_positions = {}  # label -> number of instructions before it
+
+        with self.phase("layout"):
+            for token in tokens:
+                if isinstance(token, ir.Instruction):
+                    token.address = address
+                    instructions.append(token)
+
+                    # Check if this instruction will use long form. At this
+                    # point, we have not yet resolved the labels (they are not
+                    # even all in the aliases dict). In those cases, we assume
+                    # the long form is used, and we adjust later.
+                    if self.maybe_uses_long_form(address, token.mnemonic, token.operands, aliases):
+                        token.long_form = True
+                        long_form_instructions.append((len(instructions) - 1, token))
+                        address += 2
+                    else:
+                        # It may be left over from an earlier assembly of
+                        # the same tokens
+                        token.long_form = False
+                        address += 1
+
+                elif token[0] == base.DATA_SEGMENT_START:
+
+                    if data.address is not None:
+                        raise ValueError("Can only start data segment once")
+
+                    data.address = token[1]
+
+                elif token[0] == base.CODE_SEGMENT_START:
+
+                    if code.address is not None:
+                        raise ValueError("Can only start code segment once")
+
+                    code.address = token[1]
+
+                elif token[0] == base.LABEL:
+                    name = token[1]
+                    aliases[name] = address
+                    label_positions[name] = len(instructions)
+
+                elif token[0] == base.DATA:
+                    _, value, count = token
+                    data.add_run(value, count)
+
+                    address += count
+
+        self.count("tokens", len(tokens))
+        self.count("instructions", len(instructions))
+        self.count("long_form_candidates", len(long_form_instructions))
+
+        # Figure out which instructions truly use long form.
+        with self.phase("relaxation"):
+            self.relax(instructions, long_form_instructions, aliases, label_positions)
+
+        # Fill code segment
+        code.size = 0
+
+        with self.phase("resolve"):
+            if keep_tokens:
+                instructions = self.resolved_instructions(instructions, aliases, code.instructions is not None)
+            else:
+                self.resolve_instructions(instructions, aliases)
+
+        with self.phase("encode"):
+            self.encode_instructions(instructions, code)
+
+        return code, data, stack
+
+    def assemble_one_pass(self, tokens: typing.Iterable, aliases: parser.AliasLog) -> tuple:
+        """
+        Does the same as assemble_2, but in a single pass over the tokens, so
+        the tokens can be consumed while they are being parsed (see
+        Parser.iter_sections), and instructions are encoded as soon as their
+        address is final (see iter_windows).
+        """
+        code, data, stack = create_segments()
+
+        if self.wants_listing():
+            code.instructions = []
+
+        for window in self.iter_windows(tokens, aliases, code, data):
+            self.encode_instructions(window, code)
+
+        return code, data, stack
+
+    def iter_windows(self, tokens: typing.Iterable, aliases: parser.AliasLog, code: Segment, data: Segment) -> typing.Iterator[list[ir.Instruction]]:
+        """
+        Lays out the tokens in a single pass, and yields the instructions in
+        windows, as soon as their addresses are final. The instructions are
+        resolved, but not encoded. The segment directives and the data are
+        added to the segments.
+
+        Instructions that refer to a label that is not yet defined get the
+        long form, and are recorded as fixups. As soon as all fixups are
+        resolved, the instructions since the first fixup are relaxed, resolved
+        and yielded. Only the instructions in such a window are kept in memory.
+
+        The aliases are those that the parser of the tokens assigns to (see
+        Parser.iter_sections), which logs the assignments. An instruction gets
+        the value of an alias at the time it is resolved, whereas assemble_2
+        uses the last value, so an alias that is assigned to again after an
+        instruction used it is an error.
+        """
+        address = 0
+        window = []  # instructions whose address is not final yet
+        long_form_instructions = []  # (index in window, instruction)
+        label_positions = {}  # label in window -> number of instructions before it
+        fixups = set()  # names of the undefined aliases used in the window
+        used = set()  # names of the defined aliases used by instructions
+        token_count = 0
+        instruction_count = 0
+        long_form_count = 0
+
+        # Only the assignments of the parser are checked here, not those of the
+        # relaxation below
+        aliases.log.clear()
 
         for token in tokens:
-            if token[0] == base.Token.DATA_SEGMENT_START:
+            token_count += 1
+
+            # The parser assigns EQU values and sizes without a token
+            if aliases.log:
+                self._check_assignments(aliases.log, fixups, used)
+
+            if isinstance(token, ir.Instruction):
+                token.address = address
+                window.append(token)
+                instruction_count += 1
+
+                for operand in token.operands:
+                    if isinstance(operand.value, str):
+                        if operand.value in aliases:
+                            used.add(operand.value)
+                        else:
+                            fixups.add(operand.value)
+
+                if self.maybe_uses_long_form(address, token.mnemonic, token.operands, aliases):
+                    token.long_form = True
+                    long_form_instructions.append((len(window) - 1, token))
+                    long_form_count += 1
+                    address += 2
+                else:
+                    address += 1
+
+            elif token[0] == base.DATA_SEGMENT_START:
 
                 if data.address is not None:
                     raise ValueError("Can only start data segment once")
 
                 data.address = token[1]
 
-            elif token[0] == base.Token.CODE_SEGMENT_START:
+            elif token[0] == base.CODE_SEGMENT_START:
 
                 if code.address is not None:
                     raise ValueError("Can only start code segment once")
 
                 code.address = token[1]
 
-            elif token[0] == base.Token.LABEL:
+            elif token[0] == base.LABEL:
                 name = token[1]
-                aliases[name] = address
 
-            elif token[0] == base.Token.DATA:
-                value = token[1]
-                data.entries.append(token)
-                all_tokens.append((address, token))
+                if name in used:
+                    raise ValueError(_REDEFINED_MESSAGE % name)
 
-                address += 1
+                if name in fixups:
+                    fixups.discard(name)
+                    used.add(name)
 
-            elif token[0] == base.Token.MNEMONIC:
-                _, mnemonic, operands = token
-                all_tokens.append((address, token))
+                # Without logging, since the label was just checked
+                dict.__setitem__(aliases, name, address)
+                label_positions[name] = len(window)
 
-                # Check if this instruction will use long form. At this point,
-                # we have not yet resolved the labels (they are not even all in
-                # the aliases dict). In those cases, we assume the long form is
-                # used, and we adjust later.
-                if self.maybe_uses_long_form(address, mnemonic, operands, aliases):
-                    long_form_tokens.append((address, token))
-                    address += 2
-                else:
-                    address += 1
+            elif token[0] == base.DATA:
+                _, value, count = token
+                data.add_run(value, count)
 
+                address += count
 
-        # Figure out which instructions truly use long form. Note that since we
-        # overestimated the number of long form instructions, only long form
-        # instructions will actually use short form, not the other way around.
-        while True:
-            newly_reduced = {}
+            if window and not fixups:
+                address -= self.relax(window, long_form_instructions, aliases, label_positions)
+                aliases.log.clear()
 
-            for i, (addr, token) in enumerate(long_form_tokens):
-                _, mnemonic, operands = token
+                self.resolve_instructions(window, aliases)
+                yield window
 
-                if not self.maybe_uses_long_form(addr, mnemonic, operands, aliases):
-                    newly_reduced[i] = addr
+                window = []
+                long_form_instructions = []
+                label_positions = {}
 
-            x = len(long_form_tokens)
+        # The parser may assign to the aliases after the last token
+        if aliases.log:
+            self._check_assignments(aliases.log, fixups, used)
 
-            # Remove the reduced tokens from the list
-            for i in reversed(newly_reduced):
-                del long_form_tokens[i]
+        # Undefined labels are reported while encoding
+        if window:
+            self.relax(window, long_form_instructions, aliases, label_positions)
+            self.resolve_instructions(window, aliases)
+            yield window
 
-            assert len(long_form_tokens) + len(newly_reduced) == x
+        self.count("tokens", token_count)
+        self.count("instructions", instruction_count)
+        self.count("long_form_candidates", long_form_count)
 
-            # No instructions changed from long form to short form - the system
-            # reached a stable state.
-            if not newly_reduced:
-                break
+    def _check_assignments(self, log: list[tuple[str, int]], fixups: set[str], used: set[str]):
+        """
+        Handles the assignments to the aliases since the last call (see
+        iter_windows), and clears the log. The fixups that they define are
+        used from then on.
+        """
+        for name, _ in log:
+            if name in used:
+                raise ValueError(_REDEFINED_MESSAGE % name)
 
-            # Update the addresses of the aliases and tokens
-            for alias in aliases:
-                value = aliases[alias]
+        for name, _ in log:
+            if name in fixups:
+                fixups.discard(name)
+                used.add(name)
 
-                # maybe reduce it
-                count = 0
-                for x in newly_reduced.values():
-                    if x < value:
-                        count += 1
+        log.clear()
 
-                aliases[alias] -= count
+    def resolve_instructions(self, instructions: list[ir.Instruction], aliases: dict[str, int]):
+        """
+        Resolves the aliases in the instructions. The instructions must have
+        their final address.
+        """
+        resolved = 0
 
-            for i, (address, token) in enumerate(all_tokens):
-                # maybe reduce it
-                count = 0
-                for x in newly_reduced.values():
-                    if x < address:
-                        count += 1
+        for instruction in instructions:
+            resolved += self.resolve_aliases(instruction, aliases)
 
-                address -= count
+        self.count("labels_resolved", resolved)
 
-                all_tokens[i] = (address, token)
+    def resolved_instructions(self, instructions: list[ir.Instruction], aliases: dict[str, int], copy_all: bool = False) -> list[ir.Instruction]:
+        """
+        Returns the instructions with their aliases resolved, without changing
+        them: the instructions that refer to aliases are replaced by resolved
+        copies, and the others (which resolving leaves alone) are shared. The
+        instructions must have their final address.
+
+        With copy_all, the others are copied as well (sharing their operands),
+        so that the result keeps its addresses and forms when the instructions
+        are laid out again, e.g. for a listing.
+        """
+        resolved = []
+        count = 0
+
+        for instruction in instructions:
+            for operand in instruction.operands:
+                if isinstance(operand.value, str):
+                    copy = instruction.copy()
+                    copy.address = instruction.address
+                    copy.long_form = instruction.long_form
+
+                    count += self.resolve_aliases(copy, aliases)
+                    break
+            else:
+                if not copy_all:
+                    resolved.append(instruction)
+                    continue
 
-        # Resolve all aliases.
-        for i, (address, token) in enumerate(all_tokens):
-            all_tokens[i] = (address, self.resolve_aliases(address, token, aliases))
+                copy = ir.Instruction(instruction.mnemonic, instruction.operands)
+                copy.address = instruction.address
+                copy.long_form = instruction.long_form
 
-        # Calculate data size
-        data.size = len(data.entries)
+            resolved.append(copy)
 
-        # Fill code segment
-        code.size = 0
+        self.count("labels_resolved", count)
 
-        for address, token in all_tokens:
-            if token[0] == base.Token.DATA:
-                continue
+        return resolved
 
-            if token[0] != base.Token.MNEMONIC:
-                raise ValueError(f"Bad code token {token}")
+    def encode_instructions(self, instructions: list[ir.Instruction], code: Segment):
+        """
+        Appends the encodings of resolved instructions to the code segment.
+        """
+        if self.stats is not None:
+            cache_info = cached_encoding.cache_info()
+
+        if self.hooks:
+            # A separate loop, so there is no per instruction cost without hooks
+            for instruction in instructions:
+                encoding = self.encode_instruction(instruction.mnemonic, instruction.operands)
+                code.entries.append(encoding)
+                code.size += len(encoding)
+
+                for hook in self.hooks:
+                    hook.instruction_encoded(instruction, encoding)
+        else:
+            for instruction in instructions:
+                encoding = self.encode_instruction(instruction.mnemonic, instruction.operands)
+                code.entries.append(encoding)
+                code.size += len(encoding)
 
-            _, mnemonic, operands = token
+        if code.instructions is not None:
+            code.instructions.extend(instructions)
 
-            encoding = self.encode_mnemonic(mnemonic, operands)
-            code.entries.append(encoding)
-            code.size += len(encoding)
+        if self.stats is not None and self.cache_encodings:
+            new_cache_info = cached_encoding.cache_info()
+            self.count("encoding_cache_hits", new_cache_info.hits - cache_info.hits)
+            self.count("encoding_cache_misses", new_cache_info.misses - cache_info.misses)
 
-            # TODO: Deduce mnemonic and operands from encoding
-            if len(encoding) == 2:
-                encoding_str = f"{encoding[0]:05x} {encoding[1]:05x}"
-            else:
-                encoding_str = f"{encoding[0]:05x} {'':5}"
+    def relax(self, instructions: list[ir.Instruction], long_form_instructions: list[tuple[int, ir.Instruction]], aliases: dict[str, int], label_positions: dict[str, int]) -> int:
+        """
+        Shortens the long form instructions that fit in the short form, and
+        updates the addresses of the instructions and labels accordingly.
+        Returns the number of shortened instructions.
 
-            if self.verbose:
-                print(f"{address:05x} {encoding_str} {mnemonic:5} {self.operands_to_str(operands)}")
+        long_form_instructions contains the instructions that (might) need the
+        long form, with their index in instructions. label_positions maps the
+        labels to the number of instructions before them.
+        """
+        # Note that since we overestimated the number of long form
+        # instructions, only long form instructions will actually use short
+        # form, not the other way around. Shortening an instruction only ever
+        # brings addresses closer to zero and to each other, so once an
+        # instruction fits in the short form, it keeps fitting. Hence the
+        # order in which the instructions are shortened doesn't matter.
+        #
+        # The addresses of the instructions are left alone until the end.
+        # Their shift is the number of shortened instructions before them,
+        # which is kept in a Fenwick tree.
+        shortened = relaxation.FenwickTree(len(instructions))
+        shifted_aliases = relaxation.ShiftedAliases(aliases, label_positions, shortened)
+        is_shortened = bytearray(len(instructions))
+        iterations = 0
 
-        return code, data, stack
+        while True:
+            iterations += 1
+            still_long_form = []
 
-    def resolve_aliases(self, address: int, token: tuple, aliases: dict) -> tuple[base.Token, list]:
-        type_ = token[0]
-        if type_ == base.Token.MNEMONIC:
-            _, mnemonic, operands = token
+            for index, instruction in long_form_instructions:
+                address = instruction.address - shortened.prefix_sum(index)
 
-            new_operands = []
-            for operand in operands:
-                operand_type = operand[0]
+                if self.maybe_uses_long_form(address, instruction.mnemonic, instruction.operands, shifted_aliases):
+                    still_long_form.append((index, instruction))
+                else:
+                    instruction.long_form = False
+                    shortened.add(index, 1)
+                    is_shortened[index] = 1
 
-                if operand_type == base.Token.AM_LABEL:
-                    name = operand[1]
-                    value = aliases[name]
+            for hook in self.hooks:
+                hook.relaxation_iteration(iterations, len(long_form_instructions) - len(still_long_form), len(still_long_form))
 
-                    if mnemonic in base.BranchInstructions:
-                        if self.uses_long_form(address, mnemonic, operands, aliases):
-                            delta = 2
-                        else:
-                            delta = 1
+            # No instructions changed from long form to short form - the system
+            # reached a stable state.
+            if len(still_long_form) == len(long_form_instructions):
+                break
 
-                        value -= address + delta
-                        value %= 2 ** 18
+            long_form_instructions = still_long_form
 
-                    new_operands.append((base.Token.AM_VALUE, value))
+        # Update the addresses of the labels and instructions. Other aliases
+        # (EQU values, sizes) are not addresses, so they stay put.
+        for label, position in label_positions.items():
+            aliases[label] -= shortened.prefix_sum(position)
 
-                elif operand_type in base.Token.AM_INDEXED | base.Token.AM_IND_INDEXED:
-                    value = operand[2]
+        shift = 0
+        for index, instruction in enumerate(instructions):
+            instruction.address -= shift
+            shift += is_shortened[index]
 
-                    if isinstance(value, str):
-                        value = aliases[value]
+        self.count("relaxation_iterations", iterations)
+        self.count("instructions_shortened", shift)
 
-                    new_operands.append((operand_type, operand[1], value))
-                else:
-                    new_operands.append(operand)
+        return shift
+
+    def resolve_aliases(self, instruction: ir.Instruction, aliases: dict[str, int]) -> int:
+        """
+        Replaces the label references in the operands of an instruction by
+        their values. The operands are modified in place. Returns the number of
+        replaced references.
+        """
+        resolved = 0
+
+        for operand in instruction.operands:
+            mode = operand.mode
+
+            if mode == base.AM_LABEL:
+                value = aliases[operand.value]
+
+                if base.InstructionSet[instruction.mnemonic].format == base.FORMAT_BRANCH:
+                    if instruction.long_form:
+                        delta = 2
+                    else:
+                        delta = 1
 
-            return (type_, mnemonic, new_operands)
+                    value -= instruction.address + delta
+                    value %= 2 ** 18
+
+                operand.mode = base.AM_VALUE
+                operand.value = value
+                resolved += 1
+
+            elif mode & base.AM_DISPLACEMENT:
+                if isinstance(operand.value, str):
+                    operand.value = aliases[operand.value]
+                    resolved += 1
+
+        return resolved
 
-        if type_ == base.Token.DATA:
-            return token
+    def layout_key(self, mnemonic: str, operands: list[ir.Operand]) -> typing.Union[bool, tuple]:
+        """
+        Returns a key for how the form of an instruction depends on the layout:
+        instructions with equal keys use the same form at the same address,
+        given the same aliases.
+        """
+        if base.InstructionSet[mnemonic].format == base.FORMAT_BRANCH or any(isinstance(operand.value, str) for operand in operands):
+            # The form depends on the address or on the aliases
+            return (mnemonic, tuple((operand.mode, operand.value) for operand in operands))
 
-        return token
+        return self.uses_long_form(0, mnemonic, operands)
 
-    def maybe_uses_long_form(self, address: int, mnemonic: str, operands: list, aliases: dict[str, int] = {}) -> bool:
+    def maybe_uses_long_form(self, address: int, mnemonic: str, operands: list[ir.Operand], aliases: dict[str, int] = {}) -> bool:
         return self._uses_long_form(address, mnemonic, operands, aliases) is not False
 
-    def uses_long_form(self, address: int, mnemonic: str, operands: list, aliases: dict[str, int] = {}) -> bool:
+    def uses_long_form(self, address: int, mnemonic: str, operands: list[ir.Operand], aliases: dict[str, int] = {}) -> bool:
         return self._uses_long_form(address, mnemonic, operands, aliases) is True
 
-    def _uses_long_form(self, address: int, mnemonic: str, operands: list, aliases: dict[str, int] = {}) -> typing.Optional[bool]:
+    def _uses_long_form(self, address: int, mnemonic: str, operands: list[ir.Operand], aliases: dict[str, int] = {}) -> typing.Optional[bool]:
         """
         Returns None on unknown label.
         """
+        info = base.InstructionSet[mnemonic]
+        size = info.value_bits
+
+        if size is None:
+            # This instruction has no long form
+            return False
 
         for operand in operands:
-            type_ = operand[0]
+            type_ = operand.mode
 
-            if type_ in base.Token.AM_LABEL | base.Token.AM_VALUE:
-                if type_ == base.Token.AM_LABEL:
-                    name = operand[1]
+            if type_ & base.AM_LABEL_OR_VALUE:
+                value = operand.value
 
-                    if name not in aliases:
+                if type_ == base.AM_LABEL:
+                    if value not in aliases:
                         return None
 
-                    value = aliases[name]
-                else:
-                    value = operand[1]
+                    value = aliases[value]
 
-                if mnemonic in base.BranchInstructions:
+                if info.format == base.FORMAT_BRANCH:
                     # Do we need long form, assuming this instruction is not
                     # long form?
                     value -= address + 1
                     value %= 2 ** 18
-                    size = 9
-
-                else:
-                    size = 8
 
                 if 2 ** (size - 1) <= value < 2 ** 18 - 2 ** (size - 1):
                     return True
 
-            if type_ in base.Token.AM_INDEXED | base.Token.AM_IND_INDEXED:
-                value = operand[2]
+            if type_ & base.AM_DISPLACEMENT:
+                value = operand.value
 
                 if isinstance(value, str):
                     if value not in aliases:
@@ -310,31 +1026,31 @@ class Assembler:
 
         return False
 
-    def operands_to_str(self, operands: list) -> str:
+    def operands_to_str(self, operands: list[ir.Operand]) -> str:
         """
         Converts a list of operands to a nice string.
         """
-        def operand_to_str(operand) -> str:
-            type_ = operand[0]
-
-            if type_ == base.Token.AM_LABEL:
-                return f"{operand[1]}"
-            if type_ == base.Token.AM_VALUE:
-                return f"0x{operand[1]:05x}"
-            if type_ == base.Token.AM_REGISTER:
-                return f"r{operand[1]}"
-            if type_ == base.Token.AM_INDEXED:
-                return f"[r{operand[1]} + 0x{operand[2]:05x}]"
-            if type_ == base.Token.AM_REG_INDEXED:
-                return f"[r{operand[1]} + r{operand[2]}]"
-            if type_ == base.Token.AM_POST_INC:
-                return f"[r{operand[1]}++]"
-            if type_ == base.Token.AM_PRE_DEC:
-                return f"[--r{operand[1]}]"
-            if type_ == base.Token.AM_IND_INDEXED:
-                return f"[[r{operand[1]}] + 0x{operand[2]:05x}]"
-            if type_ == base.Token.AM_IND_REG_INDEXED:
-                return f"[[r{operand[1]}] + r{operand[2]}]"
+        def operand_to_str(operand: ir.Operand) -> str:
+            type_ = operand.mode
+
+            if type_ == base.AM_LABEL:
+                return f"{operand.value}"
+            if type_ == base.AM_VALUE:
+                return f"0x{operand.value:05x}"
+            if type_ == base.AM_REGISTER:
+                return f"r{operand.reg}"
+            if type_ == base.AM_INDEXED:
+                return f"[r{operand.reg} + 0x{operand.value:05x}]"
+            if type_ == base.AM_REG_INDEXED:
+                return f"[r{operand.reg} + r{operand.value}]"
+            if type_ == base.AM_POST_INC:
+                return f"[r{operand.reg}++]"
+            if type_ == base.AM_PRE_DEC:
+                return f"[--r{operand.reg}]"
+            if type_ == base.AM_IND_INDEXED:
+                return f"[[r{operand.reg}] + 0x{operand.value:05x}]"
+            if type_ == base.AM_IND_REG_INDEXED:
+                return f"[[r{operand.reg}] + r{operand.value}]"
 
             return f"{operand}"
 
@@ -343,17 +1059,17 @@ class Assembler:
             for operand in operands
         )
 
-    def encode_addressing_mode(self, addressing_mode: int) -> list[int]:
+    def encode_addressing_mode(self, addressing_mode: ir.Operand) -> list[int]:
         """
         List of words - 2 iff long form. Empty list if unknown addressing mode.
         """
-        mode = addressing_mode[0]
+        mode = addressing_mode.mode
         use_long_form = False
         value = 0
 
-        if mode == base.Token.AM_VALUE:
+        if mode == base.AM_VALUE:
             aaa = 0
-            value = addressing_mode[1]
+            value = addressing_mode.value
 
             if 2 ** 7 <= value < 2 ** 18 - 2 ** 7:
                 # long form required
@@ -362,12 +1078,12 @@ class Assembler:
             else:
                 sss = value & 0xFF
 
-        elif mode == base.Token.AM_REGISTER:
+        elif mode == base.AM_REGISTER:
             aaa = 1
-            sss = addressing_mode[1] & 7
+            sss = addressing_mode.reg & 7
 
-        elif mode == base.Token.AM_INDEXED:
-            _, reg, value = addressing_mode
+        elif mode == base.AM_INDEXED:
+            reg, value = addressing_mode.reg, addressing_mode.value
 
             aaa = 4
             sss = (reg & 7) << 5
@@ -379,23 +1095,23 @@ class Assembler:
             else:
                 sss |= value & 0x1F
 
-        elif mode == base.Token.AM_REG_INDEXED:
-            _, reg0, reg1 = addressing_mode
+        elif mode == base.AM_REG_INDEXED:
+            reg0, reg1 = addressing_mode.reg, addressing_mode.value
 
             aaa, sss = 5, ((reg0 & 7) << 5) | (reg1 & 7)
 
-        elif mode == base.Token.AM_POST_INC:
-            reg = addressing_mode[1]
+        elif mode == base.AM_POST_INC:
+            reg = addressing_mode.reg
 
             aaa, sss = 5, ((reg & 7) << 5) | 0b10_001
 
-        elif mode == base.Token.AM_PRE_DEC:
-            reg = addressing_mode[1]
+        elif mode == base.AM_PRE_DEC:
+            reg = addressing_mode.reg
 
             aaa, sss = 5, ((reg & 7) << 5) | 0b11_111
 
-        elif mode == base.Token.AM_IND_INDEXED:
-            _, reg, value = addressing_mode
+        elif mode == base.AM_IND_INDEXED:
+            reg, value = addressing_mode.reg, addressing_mode.value
 
             aaa = 6
             sss = (reg & 7) << 5
@@ -407,8 +1123,8 @@ class Assembler:
             else:
                 sss |= value & 0x1F
 
-        elif mode == base.Token.AM_IND_REG_INDEXED:
-            _, reg0, reg1 = addressing_mode
+        elif mode == base.AM_IND_REG_INDEXED:
+            reg0, reg1 = addressing_mode.reg, addressing_mode.value
 
             aaa, sss = 7, (reg0 & 7) << 5 | (reg1 & 7)
 
@@ -426,95 +1142,121 @@ class Assembler:
 
         return result
 
-    def encode_mnemonic(self, mnemonic: str, operands: list[tuple[base.Token, int]]) -> list[int]:
+    def encode_instruction(self, mnemonic: str, operands: list[ir.Operand]) -> tuple[int, ...]:
         """
-        Encodes a mnemonic to a list of words as integers.
+        Encodes a resolved instruction to a tuple of words, using the encoding
+        cache (if enabled).
         """
-        if mnemonic == "CONS":
-            # Cons is so simple - special case it
-            assert len(operands) == 1 and operands[0][0] == base.Token.AM_VALUE
-            return [operands[0][1]]
-
-        if mnemonic == "RTE":
-            # RTE is so unique - hardcode it
-            assert not operands
-            return [0b0000_100_101_111_10_001]
-
-        if mnemonic in base.BranchInstructions:
+        if not self.cache_encodings:
+            return tuple(self.encode_mnemonic(mnemonic, operands))
 
-            assert len(operands) == 1 and operands[0][0] == base.Token.AM_VALUE
-            opcode = [
-                "BRA", "BRS", "BEQ", "BNE", "BCS", "BCC", "BLS", "BHI", "BVC",
-                "BVS", "BPL", "BMI", "BLT", "BGE", "BLE", "BGT"
-            ].index(mnemonic)
+        # Special case the common operand counts, to keep cache hits cheap
+        if len(operands) == 2:
+            a, b = operands
+            return cached_encoding(mnemonic, a.mode, a.reg, a.value, b.mode, b.reg, b.value)
 
-            displacement = operands[0][1]
-            if 2 ** 8 <= displacement < 2 ** 18 - 2 ** 8:
-                # need long form
-                values = [1 << 8, displacement]
-            else:
-                values = [displacement & ((1 << 9) - 1)]
-
-            encoded = ((opcode & 0xF) << 9) | (values[0] & 0x1FF)
-
-            # now save it
-            result = [encoded]
-
-            if len(values) == 2:
-                result.append(values[1])
+        if len(operands) == 1:
+            a, = operands
+            return cached_encoding(mnemonic, a.mode, a.reg, a.value)
 
-            return result
-
-        if mnemonic in base.Traps:
-            assert not operands
-
-            if mnemonic == "RST":
-                return [0b0000_111_0000_0_000000]
-
-            traps = ["TRA0", "TRA1", "TREQ", "TRNE", "TRCS", "TRCC", "TRLS", "TRHI", "TRVC", "TRVS", "TRPL", "TRMI", "TRLT", "TRGE", "TRLE", "TRGT"]
-            id_ = traps.index(mnemonic)
+        return cached_encoding(mnemonic, *[
+            field
+            for operand in operands
+            for field in (operand.mode, operand.reg, operand.value)
+        ])
 
-            return [(7 << 11) | (id_ << 7) | (1 << 4) | id_]
+    def encode_mnemonic(self, mnemonic: str, operands: list[ir.Operand]) -> list[int]:
+        """
+        Encodes a mnemonic to a list of words as integers.
+        """
+        info = base.InstructionSet.get(mnemonic)
 
-        if mnemonic in base.UnaryInstructions:
-            un_insn = ["JMP", "JSR", "CLRI", "SETI", "PSEM", "VSEM"]
-            id_ = un_insn.index(mnemonic)
+        if info is None:
+            raise ValueError(f"Unknown instruction {mnemonic} with {len(operands)} operands.")
 
-            addressing_encoding = self.encode_addressing_mode(operands[0])
+        encoder = self._encoders.get(info.format)
 
-            if not addressing_encoding:
-                raise ValueError(f"Invalid addressing mode {operands[0]}")
+        if encoder is None:
+            raise ValueError(f"Unimplemented instruction {mnemonic} with {len(operands)} operands.")
 
-            result = [(1 << 14) | (id_ << 11) | addressing_encoding[0] & 0x7FF]
+        return encoder(self, info, operands)
 
-            if len(addressing_encoding) == 2:
-                result.append(addressing_encoding[1])
+    def _encode_binary(self, info: base.InstructionInfo, operands: list[ir.Operand]) -> list[int]:
+        reg = operands[0].reg
+        addressing_encoding = self.encode_addressing_mode(operands[1])
 
-            return result
+        if not addressing_encoding:
+            raise ValueError(f"Invalid addressing mode {operands[1]}")
 
-        if mnemonic in base.BinaryInstructions:
-            # TODO: Move to base.py or something
-            binary_opcodes = ["LOAD", "ADD", "SUB", "CMP", "MULS", "MULL", "CHCK", "DIV", "MOD", "DVMOD", "AND", "OR", "XOR", "STOR"]
+        result = [info.opcode | ((reg & 7) << 11) | (addressing_encoding[0] & 0x7FF)]
 
-            # Encode the various parts
-            opcode = 2 + binary_opcodes.index(mnemonic)
-            reg = operands[0][1]
-            addressing_encoding = self.encode_addressing_mode(operands[1])
+        if len(addressing_encoding) == 2:
+            result.append(addressing_encoding[1])
 
-            if not addressing_encoding:
-                raise ValueError(f"Invalid addressing mode {operands[1]}")
+        return result
 
-            encoded = ((opcode & 0xF) << 14) | ((reg & 7) << 11) | (addressing_encoding[0] & 0x7FF)
+    def _encode_unary(self, info: base.InstructionInfo, operands: list[ir.Operand]) -> list[int]:
+        addressing_encoding = self.encode_addressing_mode(operands[0])
 
-            # now save it
-            result = [encoded]
+        if not addressing_encoding:
+            raise ValueError(f"Invalid addressing mode {operands[0]}")
 
-            if len(addressing_encoding) == 2:
-                result.append(addressing_encoding[1])
+        result = [info.opcode | (addressing_encoding[0] & 0x7FF)]
 
-            return result
+        if len(addressing_encoding) == 2:
+            result.append(addressing_encoding[1])
 
-        if mnemonic in base.Instructions[len(operands)]:
-            raise ValueError(f"Unimplemented instruction {mnemonic} with {len(operands)} operands.")
+        return result
 
-        raise ValueError(f"Unknown instruction {mnemonic} with {len(operands)} operands.")
+    def _encode_branch(self, info: base.InstructionInfo, operands: list[ir.Operand]) -> list[int]:
+        assert len(operands) == 1 and operands[0].mode == base.AM_VALUE
+
+        displacement = operands[0].value
+
+        if 2 ** 8 <= displacement < 2 ** 18 - 2 ** 8:
+            # need long form
+            return [info.opcode | (1 << 8), displacement]
+
+        return [info.opcode | (displacement & 0x1FF)]
+
+    def _encode_fixed(self, info: base.InstructionInfo, operands: list[ir.Operand]) -> list[int]:
+        assert not operands
+        return [info.opcode]
+
+    def _encode_cons(self, info: base.InstructionInfo, operands: list[ir.Operand]) -> list[int]:
+        assert len(operands) == 1 and operands[0].mode == base.AM_VALUE
+        return [operands[0].value]
+
+    # Maps the instruction formats to their encoder
+    _encoders = {
+        base.FORMAT_BINARY: _encode_binary,
+        base.FORMAT_UNARY: _encode_unary,
+        base.FORMAT_BRANCH: _encode_branch,
+        base.FORMAT_FIXED: _encode_fixed,
+        base.FORMAT_CONS: _encode_cons,
+    }
+
+def assemble_source(source: str, one_pass: bool = False) -> Image:
+    """
+    Assembles source code without touching the file system, e.g.
+    assemble_source(text).to_hex().
+    """
+    return Assembler(None, None, False, one_pass).assemble_source(source)
+
+@functools.lru_cache(maxsize=4096)
+def cached_encoding(mnemonic: str, *fields: typing.Union[int, str, None]) -> tuple[int, ...]:
+    """
+    Encodes a resolved instruction to a tuple of words. The operands are given
+    as their (mode, reg, value) fields, one after the other.
+
+    Programs repeat the same instructions (PUSH R1, LOAD R0 [SP++], ...) a lot,
+    so the encodings are cached. The cache is shared by all assemblies in this
+    process. cached_encoding.cache_info() gives the hit and miss counts.
+    """
+    operands = [ir.Operand(*fields[i:i + 3]) for i in range(0, len(fields), 3)]
+
+    return tuple(_encoder.encode_mnemonic(mnemonic, operands))
+
+# The assembler used by cached_encoding. Encoding doesn't depend on any of the
+# assembler's settings.
+_encoder = Assembler(None, None, False)
@@ -1,4 +1,5 @@
 import enum
+import typing
 
 class AddressingMode(enum.Flag):
     LABEL_VALUE         = 0x0001
@@ -32,6 +33,34 @@ class Token(enum.Flag):
     CODE_SEGMENT_START  = 0x1000
     DATA_SEGMENT_START  = 0x2000
 
+# Plain integer versions of the Token kinds. The parser and assembler store and
+# compare these rather than the Token members, since operations on enum.Flag
+# members (in particular '|' and 'in') are slow compared to integer arithmetic.
+# Use Token(kind) to convert a kind back to its Token member.
+AM_LABEL            = Token.AM_LABEL.value
+AM_VALUE            = Token.AM_VALUE.value
+AM_REGISTER         = Token.AM_REGISTER.value
+AM_INDEXED          = Token.AM_INDEXED.value
+AM_REG_INDEXED      = Token.AM_REG_INDEXED.value
+AM_POST_INC         = Token.AM_POST_INC.value
+AM_PRE_DEC          = Token.AM_PRE_DEC.value
+AM_IND_INDEXED      = Token.AM_IND_INDEXED.value
+AM_IND_REG_INDEXED  = Token.AM_IND_REG_INDEXED.value
+
+ANY_ADDRESSING_MODE = Token.ANY_ADDRESSING_MODE.value
+
+DATA                = Token.DATA.value
+MNEMONIC            = Token.MNEMONIC.value
+LABEL               = Token.LABEL.value
+CODE_SEGMENT_START  = Token.CODE_SEGMENT_START.value
+DATA_SEGMENT_START  = Token.DATA_SEGMENT_START.value
+
+# Addressing modes with an immediate value (that may need the long form)
+AM_LABEL_OR_VALUE   = AM_LABEL | AM_VALUE
+
+# Addressing modes with a displacement (that may need the long form)
+AM_DISPLACEMENT     = AM_INDEXED | AM_IND_INDEXED
+
 
 # Section 4.4
 BinaryInstructions = {
@@ -61,61 +90,131 @@ MiscInstructions = {
     "RTS", "RTE", "PUSH", "PULL", "CONS"
 }
 
+# Instruction formats
+FORMAT_BINARY       = 0  # opcode, register and addressing mode (section 4.4)
+FORMAT_UNARY        = 1  # opcode and addressing mode (section 4.5)
+FORMAT_BRANCH       = 2  # opcode and relative displacement (section 4.6)
+FORMAT_FIXED        = 3  # a single fixed word (sections 4.7 and 4.8)
+FORMAT_CONS         = 4  # the operand value itself (section 4.8)
+FORMAT_SIMPLIFIED   = 5  # rewritten to another instruction by the parser
+
+class InstructionInfo(typing.NamedTuple):
+    # One of the FORMAT_* constants
+    format: int
+
+    # The bits of the (first) word that identify the instruction, already
+    # shifted into place. For FORMAT_FIXED, this is the complete word.
+    opcode: int
+
+    # The allowed types of the operands
+    operands: list[Token]
+
+    # The number of bits available for an immediate value (or displacement) in
+    # the short form, or None if the instruction has no long form.
+    value_bits: typing.Optional[int] = None
+
+def _trap(condition: int) -> InstructionInfo:
+    return InstructionInfo(FORMAT_FIXED, (7 << 11) | (condition << 7) | (1 << 4) | condition, [])
+
+def _branch(condition: int) -> InstructionInfo:
+    return InstructionInfo(FORMAT_BRANCH, condition << 9, [Token.AM_LABEL], 9)
+
+def _unary(opcode: int, operand: Token) -> InstructionInfo:
+    return InstructionInfo(FORMAT_UNARY, (1 << 14) | (opcode << 11), [operand], 8)
+
+def _binary(opcode: int, operand: Token) -> InstructionInfo:
+    return InstructionInfo(FORMAT_BINARY, opcode << 14, [Token.AM_REGISTER, operand], 8)
+
+# The instruction set. Everything the parser and the assembler need to know
+# about an instruction is derived from this table.
+InstructionSet = {
+    # Section 4.4
+    "LOAD":  _binary(0x2, Token.ANY_ADDRESSING_MODE),
+    "ADD":   _binary(0x3, Token.ANY_ADDRESSING_MODE),
+    "SUB":   _binary(0x4, Token.ANY_ADDRESSING_MODE),
+    "CMP":   _binary(0x5, Token.ANY_ADDRESSING_MODE),
+    "MULS":  _binary(0x6, Token.ANY_ADDRESSING_MODE),
+    "MULL":  _binary(0x7, Token.ANY_ADDRESSING_MODE),
+    "CHCK":  _binary(0x8, Token.ANY_ADDRESSING_MODE),
+    "DIV":   _binary(0x9, Token.ANY_ADDRESSING_MODE),
+    "MOD":   _binary(0xA, Token.ANY_ADDRESSING_MODE),
+    "DVMOD": _binary(0xB, Token.ANY_ADDRESSING_MODE),
+    "AND":   _binary(0xC, Token.ANY_ADDRESSING_MODE),
+    "OR":    _binary(0xD, Token.ANY_ADDRESSING_MODE),
+    "XOR":   _binary(0xE, Token.ANY_ADDRESSING_MODE),
+    "STOR":  _binary(0xF, Token.ANY_ADDRESSING_MODE ^ Token.AM_VALUE ^ Token.AM_REGISTER),
+
+    # Section 4.5
+    "JMP":   _unary(0, Token.ANY_ADDRESSING_MODE ^ Token.AM_VALUE),
+    "JSR":   _unary(1, Token.ANY_ADDRESSING_MODE ^ Token.AM_VALUE),
+    "CLRI":  _unary(2, Token.ANY_ADDRESSING_MODE),
+    "SETI":  _unary(3, Token.ANY_ADDRESSING_MODE),
+
+    # Apparently PSEM and VSEM can also be used without operands... No clue how
+    # that works though, so that's unsupported for now.
+    "PSEM":  _unary(4, Token.ANY_ADDRESSING_MODE ^ Token.AM_VALUE ^ Token.AM_REGISTER),
+    "VSEM":  _unary(5, Token.ANY_ADDRESSING_MODE ^ Token.AM_VALUE ^ Token.AM_REGISTER),
+
+    # Section 4.6
+    "BRA":   _branch(0x0),
+    "BRS":   _branch(0x1),
+    "BEQ":   _branch(0x2),
+    "BNE":   _branch(0x3),
+    "BCS":   _branch(0x4),
+    "BCC":   _branch(0x5),
+    "BLS":   _branch(0x6),
+    "BHI":   _branch(0x7),
+    "BVC":   _branch(0x8),
+    "BVS":   _branch(0x9),
+    "BPL":   _branch(0xA),
+    "BMI":   _branch(0xB),
+    "BLT":   _branch(0xC),
+    "BGE":   _branch(0xD),
+    "BLE":   _branch(0xE),
+    "BGT":   _branch(0xF),
+
+    # Section 4.7
+    "TRA0":  _trap(0x0),
+    "TRA1":  _trap(0x1),
+    "TREQ":  _trap(0x2),
+    "TRNE":  _trap(0x3),
+    "TRCS":  _trap(0x4),
+    "TRCC":  _trap(0x5),
+    "TRLS":  _trap(0x6),
+    "TRHI":  _trap(0x7),
+    "TRVC":  _trap(0x8),
+    "TRVS":  _trap(0x9),
+    "TRPL":  _trap(0xA),
+    "TRMI":  _trap(0xB),
+    "TRLT":  _trap(0xC),
+    "TRGE":  _trap(0xD),
+    "TRLE":  _trap(0xE),
+    "TRGT":  _trap(0xF),
+    "RST":   InstructionInfo(FORMAT_FIXED, 0b0000_111_0000_0_000000, []),
+
+    # Section 4.8
+    "RTE":   InstructionInfo(FORMAT_FIXED, 0b0000_100_101_111_10_001, []),
+    "CONS":  InstructionInfo(FORMAT_CONS, 0, [Token.AM_VALUE]),
+    "RTS":   InstructionInfo(FORMAT_SIMPLIFIED, 0, []),
+    "PUSH":  InstructionInfo(FORMAT_SIMPLIFIED, 0, [Token.AM_REGISTER]),
+    "PULL":  InstructionInfo(FORMAT_SIMPLIFIED, 0, [Token.AM_REGISTER]),
+}
+
 # Dict to map number of operands to possible mnemonics
 Instructions = {
-    0: Traps | {"RTS", "RTE"},
-    1: UnaryInstructions | BranchInstructions | {"PUSH", "PULL", "CONS"},
-    2: BinaryInstructions,
+    count: {mnemonic for mnemonic, info in InstructionSet.items() if len(info.operands) == count}
+    for count in (0, 1, 2)
 }
 
 # Dict to map the mnemonic to operand types
 InstructionOperands = {
+    mnemonic: info.operands
+    for mnemonic, info in InstructionSet.items()
+}
 
-    "RTE": [],
-    "TRA0": [], "TRA1": [], "TREQ": [], "TRNE": [], "TRCS": [], "TRCC": [], "TRLS": [], "TRHI": [], "TRVC": [],
-    "TRVS": [], "TRPL": [], "TRMI": [], "TRLT": [], "TRGE": [], "TRLE": [], "TRGT": [], "RST": [],
-
-    "JMP": [Token.ANY_ADDRESSING_MODE ^ Token.AM_VALUE],
-    "JSR": [Token.ANY_ADDRESSING_MODE ^ Token.AM_VALUE],
-    "CLRI": [Token.ANY_ADDRESSING_MODE],
-    "SETI": [Token.ANY_ADDRESSING_MODE],
-
-    # Apparently PSEM and VSEM can also be used without operands... No clue how
-    # that works though, so that's unsupported for now.
-    "PSEM": [Token.ANY_ADDRESSING_MODE ^ Token.AM_VALUE ^ Token.AM_REGISTER],
-    "VSEM": [Token.ANY_ADDRESSING_MODE ^ Token.AM_VALUE ^ Token.AM_REGISTER],
-
-    "BRA": [Token.AM_LABEL],
-    "BRS": [Token.AM_LABEL],
-    "BEQ": [Token.AM_LABEL],
-    "BNE": [Token.AM_LABEL],
-    "BCS": [Token.AM_LABEL],
-    "BCC": [Token.AM_LABEL],
-    "BLS": [Token.AM_LABEL],
-    "BHI": [Token.AM_LABEL],
-    "BVC": [Token.AM_LABEL],
-    "BVS": [Token.AM_LABEL],
-    "BPL": [Token.AM_LABEL],
-    "BMI": [Token.AM_LABEL],
-    "BLT": [Token.AM_LABEL],
-    "BGE": [Token.AM_LABEL],
-    "BLE": [Token.AM_LABEL],
-    "BGT": [Token.AM_LABEL],
-
-    "CONS": [Token.AM_VALUE],
-
-    "LOAD": [Token.AM_REGISTER, Token.ANY_ADDRESSING_MODE],
-    "ADD":  [Token.AM_REGISTER, Token.ANY_ADDRESSING_MODE],
-    "SUB":  [Token.AM_REGISTER, Token.ANY_ADDRESSING_MODE],
-    "CMP":  [Token.AM_REGISTER, Token.ANY_ADDRESSING_MODE],
-    "MULS": [Token.AM_REGISTER, Token.ANY_ADDRESSING_MODE],
-    "MULL": [Token.AM_REGISTER, Token.ANY_ADDRESSING_MODE],
-    "CHCK": [Token.AM_REGISTER, Token.ANY_ADDRESSING_MODE],
-    "DIV":  [Token.AM_REGISTER, Token.ANY_ADDRESSING_MODE],
-    "MOD":  [Token.AM_REGISTER, Token.ANY_ADDRESSING_MODE],
-    "DVMOD":[Token.AM_REGISTER, Token.ANY_ADDRESSING_MODE],
-    "AND":  [Token.AM_REGISTER, Token.ANY_ADDRESSING_MODE],
-    "OR":   [Token.AM_REGISTER, Token.ANY_ADDRESSING_MODE],
-    "XOR":  [Token.AM_REGISTER, Token.ANY_ADDRESSING_MODE],
-    "STOR": [Token.AM_REGISTER, Token.ANY_ADDRESSING_MODE ^ Token.AM_VALUE ^ Token.AM_REGISTER],
-}
\ No newline at end of file
+# The same as InstructionOperands, but with the allowed operand types as
+# integer masks (see AM_LABEL and friends above).
+InstructionOperandMasks = {
+    mnemonic: [types.value for types in operand_types]
+    for mnemonic, operand_types in InstructionOperands.items()
+}
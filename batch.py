@@ -0,0 +1,130 @@
+import concurrent.futures
+import contextlib
+import functools
+import glob
+import io
+import json
+import os
+import signal
+import time
+import typing
+
+import assembler
+import stats
+
+class AssemblyTimeout(Exception):
+    pass
+
+def _raise_timeout(signum, frame):
+    raise AssemblyTimeout()
+
+def assemble_file(path: str, timeout: typing.Optional[float] = None, one_pass: bool = False) -> dict:
+    """
+    Assembles a single file to a hex file next to it, and returns a record
+    describing the result. Errors are reported in the record instead of being
+    raised, and so are the warnings of the parser (instead of being printed to
+    stderr, where they would be interleaved with those of the other files).
+
+    The timeout (in seconds) is enforced with SIGALRM, so the process survives
+    a timeout and can assemble the next file. On platforms without SIGALRM the
+    timeout is ignored.
+    """
+    name, _ = os.path.splitext(path)
+    output = name + ".hex"
+
+    record = {"file": path, "output": None, "status": "ok", "error": None, "warnings": []}
+    warnings = io.StringIO()
+    measurements = stats.Stats()
+
+    use_alarm = timeout is not None and hasattr(signal, "setitimer")
+    if use_alarm:
+        previous_handler = signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+
+    start = time.perf_counter()
+
+    try:
+        # The timer is disarmed inside the outer try, so that a timeout that
+        # happens just before can't escape
+        try:
+            with contextlib.redirect_stderr(warnings):
+                asm = assembler.Assembler(path, output, False, one_pass, stats_=measurements)
+
+                with measurements.phase("read"):
+                    with open(path, 'r') as f:
+                        content = f.read()
+
+                image = asm.assemble_source(content)
+
+                with measurements.phase("write"):
+                    asm.write_output(image.code, image.data, image.stack, output)
+
+                record["output"] = output
+                record["code_size"] = image.code.size
+                record["data_size"] = image.data.size
+                record["stack_size"] = image.stack.size
+        finally:
+            if use_alarm:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+
+    except AssemblyTimeout:
+        record["status"] = "timeout"
+        record["error"] = f"Timed out after {timeout} seconds"
+
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = f"{type(e).__name__}: {e}"
+
+    finally:
+        if use_alarm:
+            signal.signal(signal.SIGALRM, previous_handler)
+
+    record["warnings"] = warnings.getvalue().splitlines()
+    record["time"] = time.perf_counter() - start
+    record["phases"] = {phase_name: phase["time"] for phase_name, phase in measurements.phases.items()}
+
+    return record
+
+def find_sources(directory: str) -> list[str]:
+    """
+    Returns the .asm files in a directory and its subdirectories, sorted.
+    """
+    return sorted(glob.glob(os.path.join(directory, "**", "*.asm"), recursive=True))
+
+def assemble_batch(paths: list[str], jobs: typing.Optional[int] = None, timeout: typing.Optional[float] = None, one_pass: bool = False) -> typing.Iterator[dict]:
+    """
+    Assembles files in a pool of jobs processes (the number of CPUs by
+    default), and yields their records in the order of the paths. The worker
+    processes are reused, so they only start (and import the assembler) once.
+    """
+    worker = functools.partial(assemble_file, timeout=timeout, one_pass=one_pass)
+
+    if jobs == 1:
+        yield from map(worker, paths)
+        return
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        # Hand out the files in chunks to save on communication, but keep the
+        # chunks small enough to balance the load between the workers.
+        chunksize = max(1, len(paths) // (jobs * 16))
+
+        yield from executor.map(worker, paths, chunksize=chunksize)
+
+def run_batch(directory: str, output: typing.TextIO, jobs: typing.Optional[int] = None, timeout: typing.Optional[float] = None, one_pass: bool = False) -> int:
+    """
+    Assembles all .asm files in a directory, and writes a JSON record per file
+    (one per line) to a text stream. Returns the number of files that failed.
+    """
+    failures = 0
+
+    for record in assemble_batch(find_sources(directory), jobs, timeout, one_pass):
+        if record["status"] != "ok":
+            failures += 1
+
+        output.write(json.dumps(record) + "\n")
+        output.flush()
+
+    return failures
@@ -0,0 +1,5 @@
+# Benchmarks for the assembler. Run them from the repository root, e.g.:
+#
+#   python -m benchmarks.pipeline          (compare with benchmarks/baseline.json)
+#   python -m benchmarks.generate 10000 out.asm
+#   python -m benchmarks.token_kinds
@@ -0,0 +1,160 @@
+# Generator of synthetic PP2 programs for the benchmarks.
+#
+# Run from the repository root with:
+#   python -m benchmarks.generate <instructions> <outfile.asm> [seed]
+import random
+import sys
+import typing
+
+class Shape(typing.NamedTuple):
+    """
+    The size and shape of a generated program. The ratios are fractions
+    between 0 and 1.
+    """
+    # The number of instructions
+    instructions: int = 10_000
+
+    # The fraction of instructions that are branches or jumps to a label
+    branch_density: float = 0.3
+
+    # The fraction of label references that refer to a later label
+    forward_ratio: float = 0.5
+
+    # How many labels away a label reference may be. Labels are placed every
+    # LABEL_SPACING instructions, so a small reach keeps branches short.
+    branch_reach: int = 20
+
+    # The fraction of indexed operands with a displacement that needs the
+    # long form
+    long_displacement_ratio: float = 0.1
+
+    # The number of words reserved with DS and defined with DW
+    ds_words: int = 1_000
+    dw_words: int = 1_000
+
+    # The number of EQU definitions
+    equs: int = 50
+
+    seed: int = 0
+
+# One label every LABEL_SPACING instructions
+LABEL_SPACING = 5
+
+_BINARY = ["LOAD", "ADD", "SUB", "CMP", "MULS", "AND", "OR", "XOR", "DIV", "MOD"]
+_BRANCHES = ["BRA", "BEQ", "BNE", "BCS", "BCC", "BLT", "BGE", "BGT", "BLE"]
+_FIXED = ["RTS", "RTE", "TRA0", "TREQ", "RST"]
+
+# The number of words per DW line, and the largest DS
+_DW_PER_LINE = 8
+_MAX_DS = 256
+
+def generate(shape: Shape) -> str:
+    """
+    Returns the source of a program with the given shape.
+    """
+    rng = random.Random(shape.seed)
+    lines = []
+
+    # Data tables
+    lines.append("@DATA")
+    tables = []
+
+    words = shape.dw_words
+    while words > 0:
+        n = min(words, _DW_PER_LINE)
+        name = f"table{len(tables)}"
+        values = ", ".join(str(rng.randint(-0x1ffff, 0x1ffff)) for _ in range(n))
+        lines.append(f"  {name} DW {values}")
+        tables.append(name)
+        words -= n
+
+    words = shape.ds_words
+    while words > 0:
+        n = min(words, rng.randint(1, _MAX_DS))
+        name = f"table{len(tables)}"
+        lines.append(f"  {name} DS {n}")
+        tables.append(name)
+        words -= n
+
+    # Code
+    lines.append("@CODE")
+
+    equs = [f"C{i}" for i in range(shape.equs)]
+    for name in equs:
+        lines.append(f"  {name} EQU {rng.randint(0, 0x3ffff)}")
+
+    label_count = shape.instructions // LABEL_SPACING + 1
+
+    def label_reference(current: int) -> str:
+        if rng.random() < shape.forward_ratio:
+            target = rng.randint(current + 1, current + shape.branch_reach)
+        else:
+            target = rng.randint(current - shape.branch_reach, current)
+
+        return f"L{min(max(target, 0), label_count - 1)}"
+
+    def displacement() -> str:
+        if rng.random() < shape.long_displacement_ratio:
+            return str(rng.randint(31, 0x1ffff))
+
+        return str(rng.randint(0, 30))
+
+    def value_operand() -> str:
+        kind = rng.random()
+
+        if kind < 0.3:
+            return str(rng.randint(-128, 127))
+        if kind < 0.4 and equs:
+            return rng.choice(equs)
+        if kind < 0.5 and tables:
+            return rng.choice(tables)
+        if kind < 0.7:
+            return f"R{rng.randint(0, 7)}"
+        if kind < 0.9:
+            return f"[R{rng.randint(0, 7)} + {displacement()}]"
+
+        return rng.choice(["[SP++]", "[--R3]", "[R2 + R3]", f"[[R4] + {displacement()}]"])
+
+    for i in range(shape.instructions):
+        label = i // LABEL_SPACING
+
+        if i % LABEL_SPACING == 0:
+            lines.append(f"L{label}:")
+
+        kind = rng.random()
+
+        if kind < shape.branch_density:
+            if rng.random() < 0.8:
+                lines.append(f"  {rng.choice(_BRANCHES)} {label_reference(label)}")
+            else:
+                lines.append(f"  {rng.choice(['JMP', 'JSR'])} {label_reference(label)}")
+        elif kind < shape.branch_density + (1 - shape.branch_density) * 0.1:
+            lines.append(f"  {rng.choice(_FIXED)}")
+        elif kind < shape.branch_density + (1 - shape.branch_density) * 0.2:
+            lines.append(f"  STOR R{rng.randint(0, 7)} [R{rng.randint(0, 7)} + {displacement()}]")
+        else:
+            lines.append(f"  {rng.choice(_BINARY)} R{rng.randint(0, 7)} {value_operand()}  ; comment")
+
+    # Labels that were referenced but not placed yet
+    for label in range(shape.instructions // LABEL_SPACING + (shape.instructions % LABEL_SPACING != 0), label_count):
+        lines.append(f"L{label}: RTS")
+
+    lines.append("@END")
+
+    return "\n".join(lines) + "\n"
+
+def main():
+    if len(sys.argv) not in (3, 4):
+        print(f"usage: python -m benchmarks.generate <instructions> <outfile.asm> [seed]")
+        return
+
+    shape = Shape(instructions=int(sys.argv[1]))
+
+    if len(sys.argv) == 4:
+        shape = shape._replace(seed=int(sys.argv[3]))
+
+    with open(sys.argv[2], "w") as f:
+        f.write(generate(shape))
+
+if __name__ == "__main__":
+    main()
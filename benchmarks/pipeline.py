@@ -0,0 +1,150 @@
+# Benchmark of the phases of the assembler on generated programs.
+#
+# Every scenario is assembled a few times with a Stats object. The best time of
+# every phase is reported as lines per second, with the peak memory of the
+# phase from one extra (traced, hence slower) run. The times are compared with
+# benchmarks/baseline.json, and the exit status is 1 if a phase got slower by
+# more than the tolerance (and by more than NOISE_FLOOR, since phases of a few
+# milliseconds vary a lot between runs).
+#
+# Run from the repository root with:
+#   python -m benchmarks.pipeline [--update-baseline] [--repeat=N] [--tolerance=F]
+#
+# The baseline is specific to the machine it was recorded on. Record a new one
+# (--update-baseline) before comparing on another machine.
+import json
+import os
+import sys
+import tempfile
+
+import assembler
+import stats
+
+from . import generate
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# Slowdowns (in seconds) below this are never reported as a regression
+NOISE_FLOOR = 0.005
+
+SCENARIOS = {
+    "default": generate.Shape(instructions=20_000),
+    "branchy": generate.Shape(instructions=20_000, branch_density=0.7, forward_ratio=0.8),
+    "far": generate.Shape(instructions=20_000, branch_reach=200, long_displacement_ratio=0.5),
+    "tables": generate.Shape(instructions=5_000, ds_words=200_000, dw_words=50_000, equs=2_000),
+}
+
+# The phases of Assembler.assemble_2 (besides encoding, which is reported on
+# its own as well)
+ASSEMBLE_2_PHASES = ("layout", "relaxation", "resolve", "encode")
+
+def run(source_file: str, output_file: str, trace_memory: bool = False) -> dict:
+    """
+    Assembles a file once and returns the measured phases.
+    """
+    # Start every run with a cold encoding cache
+    assembler.cached_encoding.cache_clear()
+
+    measurements = stats.Stats(trace_memory)
+    assembler.Assembler(source_file, output_file, False, stats_=measurements).assemble()
+
+    phases = dict(measurements.phases)
+    phases["assemble_2"] = {
+        "time": sum(phases[name]["time"] for name in ASSEMBLE_2_PHASES),
+    }
+
+    if trace_memory:
+        phases["assemble_2"]["peak_memory"] = max(phases[name]["peak_memory"] for name in ASSEMBLE_2_PHASES)
+
+    return phases
+
+def benchmark(shape: generate.Shape, repeat: int) -> dict:
+    """
+    Returns, per phase, the best time, the throughput and the peak memory for
+    a program of the given shape.
+    """
+    source = generate.generate(shape)
+    lines = source.count("\n")
+
+    with tempfile.TemporaryDirectory() as directory:
+        source_file = os.path.join(directory, "program.asm")
+        output_file = os.path.join(directory, "program.hex")
+
+        with open(source_file, "w") as f:
+            f.write(source)
+
+        runs = [run(source_file, output_file) for _ in range(repeat)]
+        memory = run(source_file, output_file, trace_memory=True)
+
+    results = {}
+
+    for name in ("parse", "assemble_2", "encode", "write"):
+        best = min(phases[name]["time"] for phases in runs)
+
+        results[name] = {
+            "time": best,
+            "lines_per_second": lines / best if best else None,
+            "peak_memory": memory[name]["peak_memory"],
+        }
+
+    return results
+
+def main():
+    repeat = 5
+    tolerance = 0.25
+    update_baseline = False
+
+    for arg in sys.argv[1:]:
+        if arg.startswith("--repeat="):
+            repeat = int(arg.removeprefix("--repeat="))
+        elif arg.startswith("--tolerance="):
+            tolerance = float(arg.removeprefix("--tolerance="))
+        elif arg == "--update-baseline":
+            update_baseline = True
+        else:
+            print(f"unknown argument {arg}")
+            sys.exit(2)
+
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as f:
+            baseline = json.load(f)
+
+    results = {}
+    regressions = []
+
+    for scenario, shape in SCENARIOS.items():
+        results[scenario] = benchmark(shape, repeat)
+
+        for phase, result in results[scenario].items():
+            line = (
+                f"{scenario:8} {phase:11} {result['time'] * 1000:9.1f} ms"
+                f" {result['lines_per_second'] or 0:12,.0f} lines/s"
+                f" {result['peak_memory'] / 1024:10,.0f} KiB"
+            )
+
+            old_time = baseline.get(scenario, {}).get(phase, {}).get("time")
+
+            if old_time:
+                change = result["time"] / old_time - 1
+                line += f" {change:+7.1%}"
+
+                if change > tolerance and result["time"] - old_time > NOISE_FLOOR:
+                    line += "  REGRESSION"
+                    regressions.append((scenario, phase))
+
+            print(line)
+
+    if update_baseline:
+        with open(BASELINE_FILE, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+
+        print(f"baseline written to {BASELINE_FILE}")
+
+    elif regressions:
+        print(f"{len(regressions)} phase(s) slower than the baseline by more than {tolerance:.0%}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
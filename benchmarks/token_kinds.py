@@ -0,0 +1,134 @@
+# Benchmark of the checks on the operand kinds, on a generated program.
+#
+# The program is parsed with parser.Parser and laid out by the assembler, and
+# the checks are timed on the resulting ir.Instruction objects: the operand
+# type check of the parser, and Assembler._uses_long_form, which relaxation
+# runs for every instruction. For comparison, the same code is timed with the
+# enum.Flag Token members as kinds (as before), on copies of the instructions.
+#
+# Run from the repository root with: python -m benchmarks.token_kinds
+import timeit
+import typing
+
+import assembler
+import base
+import ir
+import parser
+
+from . import generate
+
+SHAPE = generate.Shape(instructions=20_000)
+
+def parse(source: str) -> tuple[list[ir.Instruction], dict[str, int]]:
+    """
+    Returns the laid out instructions of a program and its aliases.
+    """
+    tokens, aliases = parser.Parser(source).parseSections()
+    assembler.Assembler(None, None, False).assemble_2(tokens, aliases, keep_tokens=True)
+
+    return [token for token in tokens if isinstance(token, ir.Instruction)], aliases
+
+def with_flags(instruction: ir.Instruction) -> ir.Instruction:
+    """
+    Returns a copy of an instruction with Token members as operand kinds.
+    """
+    copy = ir.Instruction(instruction.mnemonic, [ir.Operand(base.Token(operand.mode), operand.reg, operand.value) for operand in instruction.operands])
+    copy.address = instruction.address
+
+    return copy
+
+def int_operand_checks(instructions: list[ir.Instruction]):
+    """
+    The operand type check of Parser.iter_sections.
+    """
+    for instruction in instructions:
+        for operand, expected in zip(instruction.operands, base.InstructionOperandMasks[instruction.mnemonic]):
+            if not operand.mode & expected:
+                raise ValueError
+
+def flag_operand_checks(instructions: list[ir.Instruction]):
+    """
+    The same check, on Token members.
+    """
+    for instruction in instructions:
+        for operand, expected in zip(instruction.operands, base.InstructionOperands[instruction.mnemonic]):
+            if operand.mode not in expected:
+                raise ValueError
+
+def flag_uses_long_form(address: int, mnemonic: str, operands: list[ir.Operand], aliases: dict[str, int]) -> typing.Optional[bool]:
+    """
+    Assembler._uses_long_form, on Token members.
+    """
+    info = base.InstructionSet[mnemonic]
+    size = info.value_bits
+
+    if size is None:
+        return False
+
+    for operand in operands:
+        type_ = operand.mode
+
+        if type_ in base.Token.AM_LABEL | base.Token.AM_VALUE:
+            value = operand.value
+
+            if type_ == base.Token.AM_LABEL:
+                if value not in aliases:
+                    return None
+
+                value = aliases[value]
+
+            if info.format == base.FORMAT_BRANCH:
+                value -= address + 1
+                value %= 2 ** 18
+
+            if 2 ** (size - 1) <= value < 2 ** 18 - 2 ** (size - 1):
+                return True
+
+        if type_ in base.Token.AM_INDEXED | base.Token.AM_IND_INDEXED:
+            value = operand.value
+
+            if isinstance(value, str):
+                if value not in aliases:
+                    return None
+
+                value = aliases[value]
+
+            if not 0 <= value < 31:
+                return True
+
+    return False
+
+def main():
+    instructions, aliases = parse(generate.generate(SHAPE))
+    flag_instructions = [with_flags(instruction) for instruction in instructions]
+
+    uses_long_form = assembler.Assembler(None, None, False)._uses_long_form
+
+    def int_long_form():
+        for instruction in instructions:
+            uses_long_form(instruction.address, instruction.mnemonic, instruction.operands, aliases)
+
+    def flag_long_form():
+        for instruction in flag_instructions:
+            flag_uses_long_form(instruction.address, instruction.mnemonic, instruction.operands, aliases)
+
+    # Both versions must agree, or the comparison is meaningless
+    for instruction, flag_instruction in zip(instructions, flag_instructions):
+        expected = uses_long_form(instruction.address, instruction.mnemonic, instruction.operands, aliases)
+        assert flag_uses_long_form(flag_instruction.address, flag_instruction.mnemonic, flag_instruction.operands, aliases) == expected
+
+    benchmarks = [
+        ("operand check", "enum.Flag", lambda: flag_operand_checks(flag_instructions)),
+        ("operand check", "int", lambda: int_operand_checks(instructions)),
+        ("long form", "enum.Flag", flag_long_form),
+        ("long form", "int", int_long_form),
+    ]
+
+    print(f"{len(instructions)} instructions")
+
+    for check, kinds, func in benchmarks:
+        best = min(timeit.repeat(func, number=1, repeat=7))
+        print(f"{check:14} {kinds:10} {best / len(instructions) * 1e9:8.1f} ns per instruction")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import hashlib
+import os
+import tempfile
+import time
+import typing
+
+# The modules that determine the output of the assembler. Their contents are
+# part of every key, so changing the assembler invalidates the cache.
+_SOURCES = ("assembler.py", "base.py", "ir.py", "lexer.py", "parser.py", "relaxation.py")
+
+_HEX_SUFFIX = ".hex"
+_LISTING_SUFFIX = ".lst"
+_STATS_SUFFIX = ".json"
+
+_implementation_hash = None
+
+def implementation_hash() -> str:
+    """
+    Returns a hash of the source code of the assembler.
+    """
+    global _implementation_hash
+
+    if _implementation_hash is None:
+        digest = hashlib.sha256()
+        directory = os.path.dirname(os.path.abspath(__file__))
+
+        for name in _SOURCES:
+            with open(os.path.join(directory, name), "rb") as f:
+                digest.update(f.read())
+
+        _implementation_hash = digest.hexdigest()
+
+    return _implementation_hash
+
+class CacheEntry(typing.NamedTuple):
+    hex_path: str
+    listing_path: typing.Optional[str]
+    stats_path: typing.Optional[str]  # the stats of the build that stored the entry
+
+class BuildCache:
+    """
+    A content addressed cache of assembled hex files (and listings and
+    stats) in a directory. The key of an entry is a hash of the source and of the
+    assembler itself. Entries that were not used for max_age seconds are
+    evicted, as are the least recently used entries if the cache grows beyond
+    max_size bytes.
+
+    Entries are written atomically, so several processes can share a cache.
+    """
+    def __init__(self, directory: str, max_size: int = 256 * 1024 * 1024, max_age: float = 30 * 24 * 60 * 60):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, source: typing.Union[str, bytes], includes: typing.Iterable[str] = ()) -> str:
+        """
+        Returns the key for a source, given as text or as UTF-8 encoded bytes
+        (or a memory mapped file), which have the same key. includes are the
+        paths of the files the source includes (see parser.find_includes).
+        """
+        digest = hashlib.sha256()
+        digest.update(implementation_hash().encode())
+        digest.update(source.encode() if isinstance(source, str) else source)
+
+        for path in includes:
+            digest.update(b"\0" + os.fsencode(path) + b"\0")
+
+            try:
+                with open(path, "rb") as f:
+                    digest.update(f.read())
+            except OSError:
+                # Assembling fails, so the key is never stored
+                pass
+
+        return digest.hexdigest()
+
+    def lookup(self, key: str, with_listing: bool = False) -> typing.Optional[CacheEntry]:
+        """
+        Returns the cached files for a key, or None if there are none (or if
+        a listing is requested, but was not cached). The stats path is None if
+        the entry was stored without stats.
+        """
+        hex_path = os.path.join(self.directory, key + _HEX_SUFFIX)
+        listing_path = os.path.join(self.directory, key + _LISTING_SUFFIX)
+        stats_path = os.path.join(self.directory, key + _STATS_SUFFIX)
+
+        paths = [hex_path, listing_path] if with_listing else [hex_path]
+
+        try:
+            # Mark the entry as recently used
+            for path in paths:
+                os.utime(path)
+        except FileNotFoundError:
+            return None
+
+        try:
+            os.utime(stats_path)
+        except FileNotFoundError:
+            stats_path = None
+
+        return CacheEntry(hex_path, listing_path if with_listing else None, stats_path)
+
+    def store(self, key: str, hex_path: str, listing: typing.Optional[str] = None, stats_json: typing.Optional[str] = None):
+        """
+        Adds a copy of a hex file (and the listing and the stats of the build,
+        if given) to the cache, and evicts old entries.
+        """
+        with open(hex_path, "rb") as f:
+            self._store_file(key + _HEX_SUFFIX, f.read())
+
+        if listing is not None:
+            self._store_file(key + _LISTING_SUFFIX, listing.encode())
+
+        if stats_json is not None:
+            self._store_file(key + _STATS_SUFFIX, stats_json.encode())
+
+        self.evict()
+
+    def _store_file(self, name: str, content: bytes):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+
+            os.replace(temp_path, os.path.join(self.directory, name))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def evict(self):
+        """
+        Removes the entries that are too old, and then the least recently used
+        entries until the cache is small enough.
+        """
+        now = time.time()
+        files = []
+
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith((_HEX_SUFFIX, _LISTING_SUFFIX, _STATS_SUFFIX)):
+                continue
+
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        files.sort()
+        total_size = sum(size for _, size, _ in files)
+
+        for mtime, size, path in files:
+            if now - mtime <= self.max_age and total_size <= self.max_size:
+                break
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+            total_size -= size
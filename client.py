@@ -0,0 +1,63 @@
+# Thin client for the assembler server (see server.py)
+#
+# Only imports what it needs to talk to the server, so it starts much faster
+# than main.py. Start the server with: python main.py --server[=socket]
+import json
+import os
+import socket
+import sys
+import typing
+
+import sockets
+
+def request(method: str, params: dict, socket_path: typing.Optional[str] = None) -> dict:
+    """
+    Sends a single JSON-RPC request to the server and returns its result.
+    Raises RuntimeError with the message of the server if the request failed.
+    The socket is sockets.default_socket() by default.
+    """
+    if socket_path is None:
+        socket_path = sockets.default_socket()
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+
+        message = {"jsonrpc": "2.0", "id": 1, "method": method, "params": params}
+        sock.sendall(json.dumps(message).encode() + b"\n")
+
+        with sock.makefile("rb") as f:
+            response = json.loads(f.readline())
+
+    if "error" in response:
+        raise RuntimeError(response["error"]["message"])
+
+    return response["result"]
+
+def main():
+    socket_path = None
+
+    for arg in sys.argv[1:]:
+        if arg.startswith("--socket="):
+            socket_path = arg.removeprefix("--socket=")
+
+    iofiles = [arg for arg in sys.argv[1:] if not arg.startswith("-")]
+
+    if not iofiles or '-h' in sys.argv or '--help' in sys.argv:
+        print("usage: %s [--socket=path] infile.asm [outfile.hex]" % sys.argv[0])
+        return
+
+    if len(iofiles) == 1:
+        name, _ = os.path.splitext(iofiles[0])
+        iofiles.append(name + ".hex")
+
+    # The server may run in another directory
+    params = {"path": os.path.abspath(iofiles[0]), "output": os.path.abspath(iofiles[1])}
+
+    try:
+        request("assemble", params, socket_path)
+    except (RuntimeError, OSError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
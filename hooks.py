@@ -0,0 +1,30 @@
+import ir
+
+class Hooks:
+    """
+    Base class for observers of an assembly. Subclass it, override the methods
+    of interest and register an instance with Assembler.add_hook. The methods
+    are only called if at least one hook is registered, so the assembler does
+    not pay for them otherwise.
+    """
+    def phase_start(self, name: str):
+        """
+        Called when a phase of the assembly (read, parse, layout, ...) starts.
+        """
+
+    def phase_end(self, name: str):
+        """
+        Called when a phase of the assembly ends, also if it raised.
+        """
+
+    def relaxation_iteration(self, iteration: int, shortened: int, long_form: int):
+        """
+        Called after every iteration of the relaxation, with the (1-based)
+        number of the iteration, the number of instructions it shortened and
+        the number of instructions that still use the long form.
+        """
+
+    def instruction_encoded(self, instruction: ir.Instruction, encoding: tuple[int, ...]):
+        """
+        Called after an instruction has been encoded.
+        """
@@ -0,0 +1,367 @@
+import bisect
+import itertools
+import typing
+
+import assembler
+import ir
+import parser
+
+def _common_prefix_length(a: str, b: str, limit: int) -> int:
+    """
+    Returns the length of the common prefix of a and b, up to limit. The
+    slices are compared in C, halving the uncertain range every step.
+    """
+    low, high = 0, limit
+
+    while low < high:
+        middle = (low + high + 1) // 2
+
+        if a[low:middle] == b[low:middle]:
+            low = middle
+        else:
+            high = middle - 1
+
+    return low
+
+def _common_suffix_length(a: str, b: str, limit: int) -> int:
+    """
+    Returns the length of the common suffix of a and b, up to limit.
+    """
+    low, high = 0, limit
+
+    while low < high:
+        middle = (low + high + 1) // 2
+
+        if a[len(a) - middle:len(a) - low] == b[len(b) - middle:len(b) - low]:
+            low = middle
+        else:
+            high = middle - 1
+
+    return low
+
+class _Layout(typing.NamedTuple):
+    """
+    The result of the last assembly, which is reused while edits keep the
+    layout (see IncrementalAssembler._keeps_layout).
+    """
+    aliases: dict[str, int]  # with the final addresses of the labels
+    instructions: list[ir.Instruction]  # the parsed instructions, laid out
+    code: assembler.Segment
+    data: assembler.Segment
+
+class _Edit(typing.NamedTuple):
+    """
+    Statements that were parsed again, with the tokens and alias assignments
+    of the statements they replaced.
+    """
+    instruction_index: int  # the number of instructions before the statements
+    old_tokens: list
+    old_aliases: list[tuple[str, int]]
+    new_tokens: list
+    new_aliases: list[tuple[str, int]]
+
+class IncrementalAssembler:
+    """
+    Assembles successive versions of a source, for edit-assemble loops. Only
+    the statements that may have changed since the previous version are parsed
+    again; the tokens of the others are reused. The result is the same as that
+    of a full assembly.
+
+    A statement depends on the text from its first term up to (and including
+    the character after) the first term of the next statement, since the
+    parser peeks at that term. Parsing starts at the first statement that
+    depends on changed text, and stops as soon as it reaches a statement that
+    starts in the unchanged end of the text, in the same segment as before.
+
+    If the changed statements have the same layout as the statements they
+    replace (the same forms, labels, data and alias assignments), only their
+    instructions are resolved and encoded, and everything else is taken from
+    the previous assembly. Otherwise layout, relaxation and encoding run on all
+    tokens: the relaxation finds the greatest fixpoint of the layout, which
+    can't be resumed safely from a previous layout. The parsed instructions
+    are resolved without being changed (see Assembler.resolved_instructions),
+    so they are shared between versions instead of being copied. Only the
+    instructions of a listing are copies, so that the listing of an image
+    keeps its addresses when a later version is laid out.
+    """
+    def __init__(self, assembler_: typing.Optional[assembler.Assembler] = None):
+        """
+        The phases and counters are recorded by the given assembler (if any).
+        """
+        if assembler_ is None:
+            assembler_ = assembler.Assembler(None, None, False)
+
+        self.assembler = assembler_
+        self.source = ""
+
+        # Per statement, in source order
+        self._positions = []  # offset of the first term
+        self._ends = []  # end offset of the first term
+        self._segments = []  # segment of the parser before the statement
+        self._tokens = []  # the tokens of the statement
+        self._aliases = []  # the (name, value) assignments to the aliases
+        self._dependencies = []  # the included files (see parser.IncludedFile)
+        self._instruction_counts = []  # the number of instructions
+
+        # Whether parsing stopped at an @END statement (the last statement)
+        self._stopped = False
+
+        # The last assembly, and the statements parsed again since, or None
+        # if the next assembly must start from scratch
+        self._layout: typing.Optional[_Layout] = None
+        self._edits: list[_Edit] = []
+
+    def assemble_source(self, source: str) -> assembler.Image:
+        """
+        Assembles a new version of the source.
+        """
+        with self.assembler.phase("parse"):
+            self.update(source)
+
+        layout = self._layout
+        edits = self._edits
+
+        # Reset first, so that a failed assembly isn't used as a starting point
+        self._layout = None
+        self._edits = []
+
+        if layout is not None and self._can_reuse(layout, edits):
+            layout = self._reassemble(layout, edits)
+            self.assembler.count("layouts_reused")
+        else:
+            with self.assembler.phase("parse"):
+                tokens, aliases = self.tokens_and_aliases()
+
+            code, data, _ = self.assembler.assemble_2(tokens, aliases, keep_tokens=True)
+            layout = _Layout(aliases, [token for token in tokens if isinstance(token, ir.Instruction)], code, data)
+
+        self._layout = layout
+
+        # The segments of the layout are copied, so that the image stays the
+        # same when the next version is assembled
+        code, data, stack = assembler.create_segments()
+
+        for segment, previous in ((code, layout.code), (data, layout.data)):
+            segment.address = previous.address
+            segment.size = previous.size
+            segment.entries = previous.entries[:]
+
+        if layout.code.instructions is not None:
+            code.instructions = layout.code.instructions[:]
+
+        return assembler.Image(code, data, stack)
+
+    def _can_reuse(self, layout: _Layout, edits: list[_Edit]) -> bool:
+        """
+        Returns whether the edits keep the layout, so that only the edited
+        instructions have to be assembled again.
+        """
+        # Hooks observe all phases of the assembly
+        if self.assembler.hooks:
+            return False
+
+        if self.assembler.wants_listing() and layout.code.instructions is None:
+            return False
+
+        return all(self._keeps_layout(edit) for edit in edits)
+
+    def _keeps_layout(self, edit: _Edit) -> bool:
+        """
+        Returns whether the statements of an edit lay out the same as the
+        statements they replaced. Since the form of every instruction then
+        depends on the layout in the same way, the relaxation reaches the same
+        layout.
+        """
+        if len(edit.old_tokens) != len(edit.new_tokens) or edit.old_aliases != edit.new_aliases:
+            return False
+
+        for old, new in zip(edit.old_tokens, edit.new_tokens):
+            if isinstance(old, ir.Instruction):
+                if not isinstance(new, ir.Instruction):
+                    return False
+
+                old_key = self.assembler.layout_key(old.mnemonic, old.operands)
+                if old_key != self.assembler.layout_key(new.mnemonic, new.operands):
+                    return False
+
+            # Labels, data and segment starts
+            elif old != new:
+                return False
+
+        return True
+
+    def _reassemble(self, layout: _Layout, edits: list[_Edit]) -> _Layout:
+        """
+        Returns the layout with the instructions of the edits (which keep the
+        layout) in place of the ones they replaced.
+        """
+        instructions = layout.instructions
+        code = assembler.Segment()
+        code.address = layout.code.address
+        code.size = layout.code.size
+        code.entries = layout.code.entries
+        code.instructions = layout.code.instructions
+
+        for edit in edits:
+            first = edit.instruction_index
+            new_instructions = [token for token in edit.new_tokens if isinstance(token, ir.Instruction)]
+            last = first + len(new_instructions)
+
+            for old_instruction, new_instruction in zip(instructions[first:last], new_instructions):
+                new_instruction.address = old_instruction.address
+                new_instruction.long_form = old_instruction.long_form
+
+            with self.assembler.phase("resolve"):
+                resolved = self.assembler.resolved_instructions(new_instructions, layout.aliases, code.instructions is not None)
+
+            encoded = assembler.Segment()
+
+            with self.assembler.phase("encode"):
+                self.assembler.encode_instructions(resolved, encoded)
+
+            # New lists, since the previous image may share the old ones
+            instructions = instructions[:first] + new_instructions + instructions[last:]
+            code.entries = code.entries[:first] + encoded.entries + code.entries[last:]
+
+            if code.instructions is not None:
+                code.instructions = code.instructions[:first] + resolved + code.instructions[last:]
+
+        return _Layout(layout.aliases, instructions, code, layout.data)
+
+    def update(self, source: str):
+        """
+        Parses a new version of the source, reusing the statements of the
+        previous version where possible. If parsing fails, the previous
+        version is kept. If an included file changed, everything is parsed
+        again.
+        """
+        if not all(parser.is_up_to_date(dependencies) for dependencies in self._dependencies if dependencies):
+            self.source = ""
+            self._positions = []
+            self._ends = []
+            self._segments = []
+            self._tokens = []
+            self._aliases = []
+            self._dependencies = []
+            self._instruction_counts = []
+            self._stopped = False
+            self._layout = None
+            self._edits = []
+
+        old_source = self.source
+        count = len(self._positions)
+
+        limit = min(len(old_source), len(source))
+        prefix = _common_prefix_length(old_source, source, limit)
+        suffix = _common_suffix_length(old_source, source, limit - prefix)
+
+        if prefix == len(old_source) == len(source):
+            return
+
+        delta = len(source) - len(old_source)
+        changed_end = len(source) - suffix  # in the new source
+
+        # Statement i can be reused if its dependencies end before the first
+        # changed character, which is the case if the first term of statement
+        # i + 1 ends before it.
+        before = bisect.bisect_left(self._ends, prefix)
+
+        if before == count and self._stopped:
+            # Only the text after @END changed
+            self.source = source
+            return
+
+        reused = max(before - 1, 0)
+
+        if reused:
+            start = self._positions[reused]
+            segment = self._segments[reused]
+        else:
+            start = 0
+            segment = None
+
+        aliases = parser.AliasLog()
+        positions = []
+        ends = []
+        segments = []
+        tokens = []
+        alias_starts = []
+        dependency_starts = []
+        resync = count  # the first old statement that is reused after the change
+
+        statement_parser = parser.Parser(source, start, self.assembler.input)
+
+        for token in statement_parser.iter_sections(aliases, segment, markers=True):
+            if isinstance(token, tuple) and token[0] == parser.STATEMENT_START:
+                _, position, end, segment = token
+
+                if position >= changed_end:
+                    old_position = position - delta
+                    index = bisect.bisect_left(self._positions, old_position, reused)
+
+                    if index < count and self._positions[index] == old_position and self._segments[index] == segment:
+                        resync = index
+                        break
+
+                positions.append(position)
+                ends.append(end)
+                segments.append(segment)
+                tokens.append([])
+                alias_starts.append(len(aliases.log))
+                dependency_starts.append(len(statement_parser.dependencies))
+            else:
+                tokens[-1].append(token)
+
+        alias_starts.append(len(aliases.log))
+        dependency_starts.append(len(statement_parser.dependencies))
+
+        if resync < count:
+            stopped = self._stopped
+        else:
+            stopped = bool(positions) and source[positions[-1]:ends[-1]] == "@END"
+
+        if self._layout is not None:
+            self._edits.append(_Edit(
+                sum(self._instruction_counts[:reused]),
+                list(itertools.chain.from_iterable(self._tokens[reused:resync])),
+                list(itertools.chain.from_iterable(self._aliases[reused:resync])),
+                list(itertools.chain.from_iterable(tokens)),
+                aliases.log[alias_starts[0]:],
+            ))
+
+        self.assembler.count("statements_reparsed", len(positions))
+        self.assembler.count("statements_reused", reused + count - resync)
+
+        self._positions = self._positions[:reused] + positions + [position + delta for position in self._positions[resync:]]
+        self._ends = self._ends[:reused] + ends + [end + delta for end in self._ends[resync:]]
+        self._segments = self._segments[:reused] + segments + self._segments[resync:]
+        self._tokens = self._tokens[:reused] + tokens + self._tokens[resync:]
+        self._aliases = self._aliases[:reused] + [
+            aliases.log[alias_starts[i]:alias_starts[i + 1]]
+            for i in range(len(positions))
+        ] + self._aliases[resync:]
+        self._dependencies = self._dependencies[:reused] + [
+            statement_parser.dependencies[dependency_starts[i]:dependency_starts[i + 1]]
+            for i in range(len(positions))
+        ] + self._dependencies[resync:]
+        self._instruction_counts = self._instruction_counts[:reused] + [
+            sum(isinstance(token, ir.Instruction) for token in statement_tokens)
+            for statement_tokens in tokens
+        ] + self._instruction_counts[resync:]
+        self._stopped = stopped
+        self.source = source
+
+    def tokens_and_aliases(self) -> tuple[list, dict[str, int]]:
+        """
+        Returns the tokens and the aliases of the current version, like
+        Parser.parseSections. The instructions are those of the statements, so
+        they must be assembled with keep_tokens (see Assembler.assemble_2).
+        """
+        tokens = list(itertools.chain.from_iterable(self._tokens))
+        aliases = {}
+
+        for assignments in self._aliases:
+            for name, value in assignments:
+                aliases[name] = value
+
+        return tokens, aliases
@@ -0,0 +1,75 @@
+import typing
+
+import base
+
+class Operand:
+    """
+    A single operand of an instruction.
+
+    - mode:  the addressing mode, one of the integer kinds base.AM_*
+    - reg:   the (first) register, or None if the mode has no register
+    - value: the immediate value, the displacement or the second register, or
+             None if the mode has none of these. Label references are stored
+             as their name until they are resolved.
+    """
+    __slots__ = ("mode", "reg", "value")
+
+    mode: int
+    reg: typing.Optional[int]
+    value: typing.Union[int, str, None]
+
+    def __init__(self, mode: int, reg: typing.Optional[int] = None, value: typing.Union[int, str, None] = None):
+        self.mode = mode
+        self.reg = reg
+        self.value = value
+
+    def __reduce__(self):
+        # Much faster to pickle than the default for classes with __slots__
+        return Operand, (self.mode, self.reg, self.value)
+
+    def __repr__(self) -> str:
+        return f"Operand({base.Token(self.mode).name}, {self.reg!r}, {self.value!r})"
+
+
+class Instruction:
+    """
+    A single instruction. The address and the long form flag are filled in by
+    the assembler, and the operands are resolved in place (or in a copy, see
+    Assembler.resolved_instructions).
+    """
+    __slots__ = ("mnemonic", "operands", "address", "long_form")
+
+    mnemonic: str
+    operands: list[Operand]
+    address: int
+    long_form: bool
+
+    def __init__(self, mnemonic: str, operands: list[Operand]):
+        self.mnemonic = mnemonic
+        self.operands = operands
+        self.address = 0
+        self.long_form = False
+
+    def copy(self) -> "Instruction":
+        """
+        Returns an unresolved copy of a parsed instruction, that can be
+        assembled without changing this one.
+        """
+        return Instruction(self.mnemonic, [Operand(operand.mode, operand.reg, operand.value) for operand in self.operands])
+
+    def __reduce__(self):
+        # Much faster to pickle than the default for classes with __slots__
+        return _make_instruction, (self.mnemonic, self.operands, self.address, self.long_form)
+
+    def __repr__(self) -> str:
+        return f"Instruction({self.mnemonic!r}, {self.operands!r})"
+
+def _make_instruction(mnemonic: str, operands: list[Operand], address: int, long_form: bool) -> Instruction:
+    """
+    Recreates a pickled instruction.
+    """
+    instruction = Instruction(mnemonic, operands)
+    instruction.address = address
+    instruction.long_form = long_form
+
+    return instruction
@@ -0,0 +1,154 @@
+import mmap
+import re
+import typing
+
+
+class Term(typing.NamedTuple):
+    text: str
+    line: int
+    column: int
+    pos: int  # offset in the input
+
+
+# A term is a run of non-whitespace characters. Square bracket groups (with one
+# level of nesting, for the indirect addressing modes) may contain whitespace,
+# and ASCII literals may contain any character. Commas are always a term of
+# their own. Comments are matched too, but are not captured, so they're skipped.
+_TERM_PATTERN = r"""
+    ;[^\n]*
+  | (
+        ,
+      | (?:
+            [^\s;,\[\]'"]+
+          | '[^'\n]{1,2}'
+          | "[^"\n]{1,2}"
+          | \[ (?: [^\[\]\n;] | \[ [^\[\]\n;]* \] )* \]
+          | [^\s;,]
+        )+
+    )
+"""
+
+_TERM_RE = re.compile(_TERM_PATTERN, re.VERBOSE)
+
+# The same, for inputs of bytes (such as memory mapped files)
+_TERM_RE_BYTES = re.compile(_TERM_PATTERN.encode(), re.VERBOSE)
+
+
+class Lexer:
+    def __init__(self, input_string: typing.Union[str, bytes, mmap.mmap], pos: int = 0):
+        """
+        Initialises the lexer. The input is scanned lazily, in a single pass,
+        starting at the given offset (which must not be inside a term).
+
+        The input may also be UTF-8 encoded bytes, or any other object that
+        supports the buffer protocol, like a memory mapped file. Only the text
+        of the terms is then decoded, so the input is never copied as a whole.
+        Offsets and columns count bytes instead of characters in that case.
+        """
+        self.input = input_string
+
+        if isinstance(input_string, str):
+            self._terms = self._scan(pos)
+        else:
+            self._terms = self._scan_bytes(pos)
+
+        self._lookahead = None
+
+        # Position of the last consumed term
+        self.line = 1
+        self.column = 1
+        self.pos = 0
+
+    def _scan(self, start: int) -> typing.Iterator[Term]:
+        """
+        Yields all terms in the input from the start offset, together with
+        their line, column and offset.
+        """
+        input_ = self.input
+        line = input_.count("\n", 0, start) + 1
+        line_start = input_.rfind("\n", 0, start) + 1
+        last_pos = start
+
+        for match in _TERM_RE.finditer(input_, start):
+            text = match.group(1)
+
+            if text is None:  # comment
+                continue
+
+            pos = match.start()
+
+            # Terms never span multiple lines, so it suffices to count the
+            # newlines since the start of the previous term.
+            newlines = input_.count("\n", last_pos, pos)
+            if newlines:
+                line += newlines
+                line_start = input_.rfind("\n", last_pos, pos) + 1
+
+            last_pos = pos
+
+            yield Term(text, line, pos - line_start + 1, pos)
+
+    def _scan_bytes(self, start: int) -> typing.Iterator[Term]:
+        """
+        Like _scan, for an input of bytes. Memory mapped files can't count, so
+        the newlines are counted in a copy of the (short) text between terms.
+        """
+        input_ = self.input
+        line = input_[:start].count(b"\n") + 1
+        line_start = input_.rfind(b"\n", 0, start) + 1
+        last_pos = start
+
+        for match in _TERM_RE_BYTES.finditer(input_, start):
+            text = match.group(1)
+
+            if text is None:  # comment
+                continue
+
+            pos = match.start()
+
+            newlines = input_[last_pos:pos].count(b"\n")
+            if newlines:
+                line += newlines
+                line_start = input_.rfind(b"\n", last_pos, pos) + 1
+
+            last_pos = pos
+
+            yield Term(text.decode(), line, pos - line_start + 1, pos)
+
+    def close(self):
+        """
+        Stops scanning. This releases the input, so a memory mapped file can
+        be closed even if parsing was interrupted by an error.
+        """
+        self._terms.close()
+        self._lookahead = None
+
+    def peek_term(self) -> typing.Optional[Term]:
+        """
+        Returns the next term without consuming it, or None at the end of the
+        input.
+        """
+        if self._lookahead is None:
+            self._lookahead = next(self._terms, None)
+
+        return self._lookahead
+
+    def next_term(self) -> typing.Optional[Term]:
+        """
+        Consumes and returns the next term, or None at the end of the input.
+        """
+        term = self._lookahead
+
+        if term is None:
+            term = next(self._terms, None)
+
+            if term is None:
+                return None
+        else:
+            self._lookahead = None
+
+        self.line = term.line
+        self.column = term.column
+        self.pos = term.pos
+
+        return term
@@ -0,0 +1,110 @@
+import typing
+
+import assembler
+import objectfile
+
+def link(objects: list[objectfile.ObjectFile], names: typing.Optional[list[str]] = None) -> assembler.Image:
+    """
+    Links object files into an image. The modules are placed one after the
+    other: the code of every module follows the code of the module before it,
+    and the same goes for the data. The addresses are those of the modules
+    assembled as a single program in which every reference that the linker
+    fills in uses the long form (see objectfile.ObjectAssembler). A program
+    that is assembled as a whole can be smaller, since it uses the short form
+    wherever the value fits.
+
+    A module's references are resolved against its own symbols first, and
+    then against the symbols of the other modules, which must define them
+    exactly once. names (of the object files) are used in error messages.
+    """
+    if names is None:
+        names = [f"module {index}" for index in range(len(objects))]
+
+    # The start address of every module
+    bases = []
+    size = 0
+
+    for obj in objects:
+        bases.append(size)
+        size += obj.size
+
+    # The modules that define every symbol
+    definitions = {}
+
+    for index, obj in enumerate(objects):
+        for name in obj.symbols:
+            definitions.setdefault(name, []).append(index)
+
+    def value_of(name: str, index: int) -> int:
+        if name not in objects[index].symbols:
+            modules = definitions.get(name)
+
+            if not modules:
+                raise ValueError(f"Undefined symbol {name!r} in {names[index]}")
+
+            if len(modules) > 1:
+                raise ValueError(f"Symbol {name!r} used in {names[index]} is defined in several modules: {', '.join(names[module] for module in modules)}")
+
+            index, = modules
+
+        value, relocatable = objects[index].symbols[name]
+
+        if relocatable:
+            value += bases[index]
+
+        return value
+
+    code, data, stack = assembler.create_segments()
+
+    for index, obj in enumerate(objects):
+        code.address = _segment_address(code.address, obj.code_address, "code", names[index])
+        data.address = _segment_address(data.address, obj.data_address, "data", names[index])
+
+        words = obj.words
+
+        if obj.relocations:
+            words = words[:]
+
+            for offset, kind, symbol, origin in obj.relocations:
+                value = value_of(symbol, index)
+
+                if kind == objectfile.RELOCATION_RELATIVE:
+                    value -= bases[index] + origin
+
+                words[offset] = value % 2 ** 18
+
+        position = 0
+
+        for length in obj.lengths:
+            code.entries.append(tuple(words[position:position + length]))
+            position += length
+
+        code.size += len(words)
+
+        for value, count in obj.data:
+            data.add_run(value, count)
+
+    return assembler.Image(code, data, stack)
+
+def _segment_address(address: typing.Optional[int], module_address: typing.Optional[int], segment: str, name: str) -> typing.Optional[int]:
+    """
+    Returns the address of a segment, given its address so far and its address
+    in the next module.
+    """
+    if module_address is None:
+        return address
+
+    if address is not None and address != module_address:
+        raise ValueError(f"The {segment} segment of {name} starts at {module_address:05x}, but at {address:05x} in the modules before it")
+
+    return module_address
+
+def link_files(paths: list[str], output_path: str):
+    """
+    Links object files into a hex file.
+    """
+    objects = [objectfile.read_object(path) for path in paths]
+    image = link(objects, paths)
+
+    with open(output_path, "w") as f:
+        image.write_to(f)
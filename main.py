@@ -6,6 +6,8 @@ import sys
 import os
 
 import assembler as asm
+import sockets
+import stats
 
 def main():
     # check if enough arguments were passed, show help
@@ -19,39 +21,199 @@ def main():
         return
 
     # set verbosity
-    #verbose = '-v' in sys.argv
-    verbose = True
+    verbose = '-v' in sys.argv
+
+    # write a listing file (--listing=file.lst)
+    listing = None
+    for arg in sys.argv[1:]:
+        if arg.startswith("--listing="):
+            listing = arg.removeprefix("--listing=")
+
+    # assemble while parsing, instead of after parsing everything
+    one_pass = '--one-pass' in sys.argv
+
+    # print timings and counters as JSON (--stats), or write them to a file
+    # (--stats=file.json). --trace-memory adds the peak memory of every phase.
+    stats_file = None
+    for arg in sys.argv[1:]:
+        if arg == "--stats":
+            stats_file = "-"
+        elif arg.startswith("--stats="):
+            stats_file = arg.removeprefix("--stats=")
+
+    assembly_stats = None
+    if stats_file is not None:
+        assembly_stats = stats.Stats('--trace-memory' in sys.argv)
+
+    # reuse the output of earlier assemblies of the same source (--cache=dir)
+    cache_dir = None
+    for arg in sys.argv[1:]:
+        if arg.startswith("--cache="):
+            cache_dir = arg.removeprefix("--cache=")
+
+    # serve assemble requests (JSON-RPC) on stdin/stdout (--server=-) or on a
+    # Unix socket (--server or --server=socket). The modules of the other modes
+    # are only imported when their flag is given, so that they don't slow down
+    # the start of every run.
+    for arg in sys.argv[1:]:
+        if arg == "--server" or arg.startswith("--server="):
+            import server
+
+            if arg == "--server=-":
+                server.serve_stdio()
+            elif arg == "--server":
+                server.serve_unix()
+            else:
+                server.serve_unix(arg.removeprefix("--server="))
+
+            return
+
+    # assemble all files in a directory (--batch dir/ [-j N] [--timeout=S])
+    if '--batch' in sys.argv:
+        runBatch(sys.argv[sys.argv.index('--batch') + 1:], one_pass)
+        return
 
     # drop all things in sys.argv that start with -, so we only have the input
     # and optionally the output file left.
     iofiles = [arg for arg in sys.argv[1:] if not arg[0].startswith("-")]
 
+    # link object files into a hex file (--link=out.hex a.o b.o ...)
+    for arg in sys.argv[1:]:
+        if arg.startswith("--link="):
+            if not iofiles:
+                showHelp("no object files given for --link\n\n")
+                return
+
+            import linker
+            linker.link_files(iofiles, arg.removeprefix("--link="))
+            return
+
     if not iofiles:
         # no input given
         showHelp("no input file given\n\n")
         return
 
+    # assemble to an object file, to link later on (--object)
+    object_output = '--object' in sys.argv
+
     if len(iofiles) == 1:
         # no output given, so use the name of the input (without extension) and
-        # append ".hex"
+        # append ".hex" (or ".o")
         name, _ = os.path.splitext(iofiles[0])
-        iofiles.append(name + ".hex")
+        iofiles.append(name + (".o" if object_output else ".hex"))
+
+    if object_output:
+        import objectfile
+        objectfile.assemble_file(iofiles[0], iofiles[1])
+        return
 
     # create the assembler with the input and output file names
-    assembler = asm.Assembler(iofiles[0], iofiles[1], verbose)
+    assembler = asm.Assembler(iofiles[0], iofiles[1], verbose, one_pass, listing, assembly_stats)
+
+    if cache_dir is not None:
+        import cache
+        assembler.cache = cache.BuildCache(cache_dir)
+
+    # parse large inputs in several processes (--parse-jobs=N)
+    for arg in sys.argv[1:]:
+        if arg.startswith("--parse-jobs="):
+            assembler.parse_jobs = int(arg.removeprefix("--parse-jobs="))
+
+    # memory map the input file instead of reading it into memory
+    assembler.memory_map = '--mmap' in sys.argv
+
+    # write the output while assembling
+    assembler.streaming = '--stream' in sys.argv
+
+    # reassemble whenever the input changes, until interrupted
+    if '--watch' in sys.argv:
+        import watch
+        watch.watch(assembler)
+        return
 
     # assemble
     assembler.assemble()
 
+    if assembly_stats is not None:
+        if stats_file == "-":
+            print(assembly_stats.to_json())
+        else:
+            with open(stats_file, "w") as f:
+                f.write(assembly_stats.to_json() + "\n")
+
+def runBatch(args, one_pass):
+    """
+    Assembles all .asm files in the directory given after --batch, and prints
+    a JSON record per file. Exits with status 1 if any file failed.
+    """
+    if not args or args[0].startswith("-"):
+        showHelp("no directory given for --batch\n\n")
+        return
+
+    directory = args[0]
+
+    # number of worker processes (-j N), all CPUs by default
+    jobs = None
+    if '-j' in sys.argv:
+        jobs = int(sys.argv[sys.argv.index('-j') + 1])
+
+    # time limit per file in seconds (--timeout=S)
+    timeout = None
+    for arg in sys.argv[1:]:
+        if arg.startswith("--timeout="):
+            timeout = float(arg.removeprefix("--timeout="))
+
+    import batch
+    if batch.run_batch(directory, sys.stdout, jobs, timeout, one_pass):
+        sys.exit(1)
+
 def showHelp(str_):
     """
     Shows the help info for the program
     """
-    str_ += "usage: %s [-h | --help] [-v] infile.asm [outfile.hex]\n" % sys.argv[0]
+    str_ += "usage: %s [-h | --help] [-v] [--listing=file.lst] [--one-pass]\n" % sys.argv[0]
+    str_ += "       [--stats[=file.json]] [--trace-memory] [--cache=dir] [--watch]\n"
+    str_ += "       [--parse-jobs=N] [--mmap] [--stream] infile.asm [outfile.hex]\n"
+    str_ += "   or: %s --batch dir [-j N] [--timeout=S] [--one-pass]\n" % sys.argv[0]
+    str_ += "   or: %s --object infile.asm [outfile.o]\n" % sys.argv[0]
+    str_ += "   or: %s --link=outfile.hex infile.o...\n" % sys.argv[0]
+    str_ += "   or: %s --server[=socket | =-]\n" % sys.argv[0]
     str_ += "\n"
     str_ += "arguments:\n"
     str_ += "  -h, --help       shows this help message\n"
     str_ += "  -v               verbose: print the decoded output to console\n"
+    str_ += "  --listing=file   write the decoded output to a file\n"
+    str_ += "  --one-pass       assemble while parsing, using fixups for forward\n"
+    str_ += "                   references (same output, less memory). Labels and\n"
+    str_ += "                   EQU values can't be redefined after they are used\n"
+    str_ += "  --stats[=file]   print the time spent in every phase and some\n"
+    str_ += "                   counters as JSON, or write them to a file\n"
+    str_ += "  --trace-memory   with --stats: also measure the peak memory of\n"
+    str_ += "                   every phase (slows down assembling)\n"
+    str_ += "  --batch dir      assemble all .asm files in dir (and subdirectories)\n"
+    str_ += "                   and print a JSON record per file\n"
+    str_ += "  -j N             with --batch: the number of processes (default: all\n"
+    str_ += "                   CPUs)\n"
+    str_ += "  --timeout=S      with --batch: give up on a file after S seconds\n"
+    str_ += "  --cache=dir      look up the output in (and add it to) a cache of\n"
+    str_ += "                   assembled files in dir. With --stats, a hit also\n"
+    str_ += "                   reports the stats of the build that was cached\n"
+    str_ += "  --parse-jobs=N   experimental: parse large inputs in N processes\n"
+    str_ += "  --mmap           memory map the input file instead of reading it;\n"
+    str_ += "                   with --one-pass, memory use doesn't grow with the\n"
+    str_ += "                   size of the input\n"
+    str_ += "  --stream         write the output while assembling, in a single pass\n"
+    str_ += "                   (least memory, especially with --mmap)\n"
+    str_ += "  --watch          reassemble every time the input file changes\n"
+    str_ += "  --object         assemble to a relocatable object file, to link with\n"
+    str_ += "                   other object files later on\n"
+    str_ += "  --link=file.hex  link object files into a hex file. Symbols that an\n"
+    str_ += "                   object file doesn't define are looked up in the\n"
+    str_ += "                   others\n"
+    str_ += "  --server[=path]  serve JSON-RPC assemble requests on a Unix socket\n"
+    str_ += "                   (default: %s),\n" % sockets.default_socket()
+    str_ += "                   or on stdin/stdout for --server=-. Use client.py to\n"
+    str_ += "                   send requests\n"
     str_ += "  infile.asm       the input file to assemble\n"
     str_ += "  outfile.hex      optional: the output file\n"
     print(str_)
@@ -0,0 +1,278 @@
+import array
+import itertools
+import struct
+import sys
+import typing
+
+import assembler
+import base
+import ir
+import parser
+
+# The kinds of relocations
+RELOCATION_ABSOLUTE = 0  # the word is the value of the symbol
+RELOCATION_RELATIVE = 1  # the word is the value of the symbol, minus the address after the instruction
+
+_MAGIC = b"PP2O"
+_VERSION = 1
+
+# magic, version, code address, data address (-1 for a missing segment), size,
+# and the number of instructions, words, data runs, names, symbols and
+# relocations that follow
+_HEADER = struct.Struct("<4sHiiIIIIIII")
+_NAME_LENGTH = struct.Struct("<H")
+
+# The words are stored as 32-bit little endian integers
+_WORD_TYPE = "I"
+_WORD_SIZE = array.array(_WORD_TYPE).itemsize
+
+# The value of a reference until the linker fills it in. It only fits in the
+# long form of every instruction, so that the space for the value is reserved.
+_PLACEHOLDER = 2 ** 17
+
+class Relocation(typing.NamedTuple):
+    offset: int  # of the word in the code segment of the module
+    kind: int  # RELOCATION_ABSOLUTE or RELOCATION_RELATIVE
+    symbol: str
+
+    # For relative relocations: the address after the instruction, in the
+    # module. 0 otherwise.
+    origin: int
+
+class ObjectFile(typing.NamedTuple):
+    """
+    An assembled module, that can be linked with other modules (see linker.py).
+    Addresses are relative to the start of the module, like the addresses of a
+    program that is assembled as a whole.
+    """
+    code_address: typing.Optional[int]
+    data_address: typing.Optional[int]
+    size: int  # the number of words of code and data
+
+    lengths: bytes  # the number of words of every instruction
+    words: array.array  # the words of the instructions
+    data: list[tuple[int, int]]  # (value, count) runs
+
+    # Every alias of the module (labels, EQU values and sizes), with whether
+    # its value is an address in the module
+    symbols: dict[str, tuple[int, bool]]
+
+    # The words that the linker fills in
+    relocations: list[Relocation]
+
+    def write_to(self, f: typing.BinaryIO):
+        """
+        Writes the object file in its binary format.
+        """
+        names = {}
+        for name in itertools.chain(self.symbols, (relocation.symbol for relocation in self.relocations)):
+            names.setdefault(name, len(names))
+
+        data = array.array(_WORD_TYPE, itertools.chain.from_iterable(self.data))
+
+        symbols = array.array(_WORD_TYPE)
+        for name, (value, relocatable) in self.symbols.items():
+            symbols.extend((names[name], value, relocatable))
+
+        relocations = array.array(_WORD_TYPE)
+        for offset, kind, symbol, origin in self.relocations:
+            relocations.extend((offset, kind, names[symbol], origin))
+
+        f.write(_HEADER.pack(
+            _MAGIC, _VERSION,
+            -1 if self.code_address is None else self.code_address,
+            -1 if self.data_address is None else self.data_address,
+            self.size,
+            len(self.lengths), len(self.words), len(self.data), len(names), len(self.symbols), len(self.relocations),
+        ))
+
+        f.write(self.lengths)
+        f.write(_to_bytes(self.words))
+        f.write(_to_bytes(data))
+
+        for name in names:
+            encoded = name.encode()
+            f.write(_NAME_LENGTH.pack(len(encoded)))
+            f.write(encoded)
+
+        f.write(_to_bytes(symbols))
+        f.write(_to_bytes(relocations))
+
+    @classmethod
+    def read_from(cls, f: typing.BinaryIO) -> "ObjectFile":
+        """
+        Reads an object file in its binary format.
+        """
+        header = f.read(_HEADER.size)
+
+        if len(header) < _HEADER.size or header[:len(_MAGIC)] != _MAGIC:
+            raise ValueError("Not an object file")
+
+        _, version, code_address, data_address, size, instruction_count, word_count, run_count, name_count, symbol_count, relocation_count = _HEADER.unpack(header)
+
+        if version != _VERSION:
+            raise ValueError(f"Unsupported object file version {version}")
+
+        lengths = _read(f, instruction_count)
+        words = _read_words(f, word_count)
+        data = _read_words(f, 2 * run_count)
+
+        names = []
+        for _ in range(name_count):
+            length, = _NAME_LENGTH.unpack(_read(f, _NAME_LENGTH.size))
+            names.append(_read(f, length).decode())
+
+        symbols = _read_words(f, 3 * symbol_count)
+        relocations = _read_words(f, 4 * relocation_count)
+
+        return cls(
+            None if code_address == -1 else code_address,
+            None if data_address == -1 else data_address,
+            size,
+            lengths,
+            words,
+            list(zip(data[0::2], data[1::2])),
+            {names[name]: (value, bool(relocatable)) for name, value, relocatable in zip(symbols[0::3], symbols[1::3], symbols[2::3])},
+            [Relocation(offset, kind, names[symbol], origin) for offset, kind, symbol, origin in zip(*[iter(relocations)] * 4)],
+        )
+
+def _to_bytes(values: array.array) -> bytes:
+    if sys.byteorder == "big":
+        values = array.array(values.typecode, values)
+        values.byteswap()
+
+    return values.tobytes()
+
+def _read(f: typing.BinaryIO, size: int) -> bytes:
+    data = f.read(size)
+
+    if len(data) != size:
+        raise ValueError("Truncated object file")
+
+    return data
+
+def _read_words(f: typing.BinaryIO, count: int) -> array.array:
+    values = array.array(_WORD_TYPE, _read(f, count * _WORD_SIZE))
+
+    if sys.byteorder == "big":
+        values.byteswap()
+
+    return values
+
+class ObjectAssembler(assembler.Assembler):
+    """
+    Assembles a module to an object file. The references that the linker fills
+    in always use the long form: references to labels, which move with the
+    module (except from branches to them, whose displacement doesn't change),
+    references to symbols that the module doesn't define, which are imported
+    from other modules, and branches to absolute values.
+    """
+    def __init__(self, input_: typing.Optional[str] = None):
+        """
+        input_ is the file the source is read from, if any (see
+        parser.Parser).
+        """
+        super().__init__(input_, None, False)
+
+        # The labels of the module being assembled
+        self.labels = set()
+
+        # (instruction, kind, symbol, origin) for every reference that the
+        # linker fills in
+        self.relocations = []
+
+    def assemble_object(self, source: str) -> ObjectFile:
+        with self.phase("parse"):
+            self.parser = parser.Parser(source, path=self.input)
+            tokens, aliases = self.parser.parseSections()
+
+        self.labels = {token[1] for token in tokens if not isinstance(token, ir.Instruction) and token[0] == base.LABEL}
+        self.relocations = []
+
+        code, data, _ = self.assemble_2(tokens, aliases)
+
+        offsets = {}  # id of the instruction -> offset in the code segment
+        lengths = bytearray()
+        words = array.array(_WORD_TYPE)
+
+        for instruction, encoding in zip(code.instructions, code.entries):
+            offsets[id(instruction)] = len(words)
+            lengths.append(len(encoding))
+            words.extend(encoding)
+
+        # The value is always in the second word of the long form
+        relocations = [
+            Relocation(offsets[id(instruction)] + 1, kind, symbol, origin)
+            for instruction, kind, symbol, origin in self.relocations
+        ]
+
+        symbols = {name: (value, name in self.labels) for name, value in aliases.items()}
+
+        return ObjectFile(code.address, data.address, code.size + data.size, bytes(lengths), words, data.entries, symbols, relocations)
+
+    def wants_listing(self) -> bool:
+        # The instructions are needed to find the words to relocate
+        return True
+
+    def is_relocated(self, name: str, is_branch: bool, aliases: dict[str, int]) -> bool:
+        """
+        Returns whether the linker fills in a reference to name. The
+        displacement of a branch only stays the same for targets in the
+        module: branches to absolute values (EQU) move away from their target
+        with the module, like branches to other modules.
+        """
+        if is_branch:
+            return name not in self.labels
+
+        return name in self.labels or name not in aliases
+
+    def _uses_long_form(self, address: int, mnemonic: str, operands: list[ir.Operand], aliases: dict[str, int] = {}) -> typing.Optional[bool]:
+        is_branch = base.InstructionSet[mnemonic].format == base.FORMAT_BRANCH
+
+        for operand in operands:
+            if (operand.mode == base.AM_LABEL or operand.mode & base.AM_DISPLACEMENT) and isinstance(operand.value, str):
+                if self.is_relocated(operand.value, is_branch, aliases):
+                    return True
+
+        return super()._uses_long_form(address, mnemonic, operands, aliases)
+
+    def resolve_aliases(self, instruction: ir.Instruction, aliases: dict[str, int]) -> int:
+        is_branch = base.InstructionSet[instruction.mnemonic].format == base.FORMAT_BRANCH
+
+        for operand in instruction.operands:
+            if (operand.mode == base.AM_LABEL or operand.mode & base.AM_DISPLACEMENT) and isinstance(operand.value, str):
+                if self.is_relocated(operand.value, is_branch, aliases):
+                    if is_branch:
+                        self.relocations.append((instruction, RELOCATION_RELATIVE, operand.value, instruction.address + 2))
+                    else:
+                        self.relocations.append((instruction, RELOCATION_ABSOLUTE, operand.value, 0))
+
+                    if operand.mode == base.AM_LABEL:
+                        operand.mode = base.AM_VALUE
+
+                    operand.value = _PLACEHOLDER
+
+        return super().resolve_aliases(instruction, aliases)
+
+def assemble_object(source: str, path: typing.Optional[str] = None) -> ObjectFile:
+    """
+    Assembles the source of a module (read from path, if any) to an object
+    file.
+    """
+    return ObjectAssembler(path).assemble_object(source)
+
+def assemble_file(input_path: str, output_path: str):
+    """
+    Assembles a source file to an object file.
+    """
+    with open(input_path, "r") as f:
+        source = f.read()
+
+    obj = assemble_object(source, input_path)
+
+    with open(output_path, "wb") as f:
+        obj.write_to(f)
+
+def read_object(path: str) -> ObjectFile:
+    with open(path, "rb") as f:
+        return ObjectFile.read_from(f)
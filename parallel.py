@@ -0,0 +1,246 @@
+import bisect
+import concurrent.futures
+import gc
+import os
+import re
+import typing
+
+import parser
+
+# No chunk but the last is smaller than this. Inputs smaller than twice this
+# size are parsed sequentially, since they don't split into two such chunks.
+_MIN_CHUNK_SIZE = 256 * 1024
+
+# The number of chunks per process, to balance the load
+_CHUNKS_PER_JOB = 4
+
+# Chunks start at the start of a line, preferably one that starts a statement:
+# not a comment, and not a value that could continue a DW statement.
+_BOUNDARY_RE = re.compile(r"\n(?=[ \t]*[^\s0-9\-$%'\",;])")
+
+_SEGMENT_RE = re.compile(r"^[ \t]*@(CODE|DATA)\b", re.MULTILINE)
+
+class Chunk(typing.NamedTuple):
+    """
+    The statements parsed from a part of the input.
+    """
+    positions: list[int]  # offset of the first term of every statement
+    segments: list[typing.Optional[str]]  # segment before every statement
+    token_starts: list[int]  # index of the first token of every statement
+    alias_starts: list[int]  # index of the first alias of every statement
+    tokens: list
+    aliases: list[tuple[str, int]]  # assignments to the aliases, in order
+
+    # The offset and segment of the first statement after the chunk
+    stop: int
+    stop_segment: typing.Optional[str]
+
+    # Whether parsing ended (at @END or the end of the input)
+    ended: bool
+
+    # The error that ended parsing, if any
+    error: typing.Optional[Exception]
+
+def parse_chunk(source: str, start: int, segment: typing.Optional[str], end: int, targets: typing.Optional[Chunk] = None, path: typing.Optional[str] = None) -> tuple[Chunk, typing.Optional[int]]:
+    """
+    Parses the statements from the start offset (in the given segment) until
+    the first statement that starts at or after end. Errors are not raised,
+    but returned in the chunk.
+
+    If targets is given, parsing also stops at the first statement that the
+    targets chunk has as well (at the same offset, in the same segment). The
+    index of that statement in targets is returned too. path is the file the
+    source was read from (see parser.Parser).
+    """
+    aliases = parser.AliasLog()
+    positions = []
+    segments = []
+    token_starts = []
+    alias_starts = []
+    tokens = []
+
+    stop = end
+    stop_segment = None
+    ended = False
+    error = None
+    target = None
+
+    try:
+        for token in parser.Parser(source, start, path).iter_sections(aliases, segment, markers=True):
+            if isinstance(token, tuple) and token[0] == parser.STATEMENT_START:
+                _, position, _, segment = token
+
+                if targets is not None:
+                    index = bisect.bisect_left(targets.positions, position)
+
+                    if index < len(targets.positions) and targets.positions[index] == position and targets.segments[index] == segment:
+                        target = index
+
+                if target is not None or position >= end:
+                    stop = position
+                    stop_segment = segment
+                    break
+
+                positions.append(position)
+                segments.append(segment)
+                token_starts.append(len(tokens))
+                alias_starts.append(len(aliases.log))
+            else:
+                tokens.append(token)
+        else:
+            stop = len(source)
+            ended = True
+
+    except Exception as e:
+        error = e
+
+    chunk = Chunk(positions, segments, token_starts, alias_starts, tokens, aliases.log, stop, stop_segment, ended, error)
+
+    return chunk, target
+
+# The input and its path, in the worker processes
+_source = None
+_path = None
+
+def _init_worker(source: str, path: typing.Optional[str]):
+    global _source, _path
+    _source = source
+    _path = path
+
+def _parse_chunk_in_worker(start: int, segment: typing.Optional[str], end: int) -> Chunk:
+    chunk, _ = parse_chunk(_source, start, segment, end, path=_path)
+    return chunk
+
+def split(source: str, count: int) -> list[int]:
+    """
+    Returns the offsets at which to split the input into (at most) count
+    chunks, including 0 and len(source).
+    """
+    size = max(len(source) // count, _MIN_CHUNK_SIZE)
+    boundaries = [0]
+
+    while boundaries[-1] + size < len(source):
+        match = _BOUNDARY_RE.search(source, boundaries[-1] + size)
+
+        if match is None:
+            break
+
+        boundaries.append(match.start() + 1)
+
+    boundaries.append(len(source))
+
+    return boundaries
+
+def guess_segment(source: str, directives: list[tuple[int, str]], position: int) -> typing.Optional[str]:
+    """
+    Guesses the segment at an offset from the last segment directive before
+    it. The guess may be wrong (for a directive in a comment, for instance),
+    which only costs time: chunks that were parsed in the wrong segment are
+    parsed again.
+    """
+    index = bisect.bisect_right(directives, (position, "")) - 1
+
+    if index < 0:
+        return None
+
+    return directives[index][1]
+
+def parse(source: str, jobs: typing.Optional[int] = None, path: typing.Optional[str] = None) -> tuple[list, dict[str, int]]:
+    """
+    Parses the input in a pool of jobs processes (the number of CPUs by
+    default). Returns the same tokens and aliases as Parser.parseSections,
+    and raises the same errors.
+
+    The input is split at line boundaries, and each chunk is parsed with the
+    segment guessed from the directives before it. The chunks are then
+    checked in order: a chunk is used from the statement where the previous
+    chunk stopped, if it parsed that statement in the same segment. Otherwise,
+    the input is parsed sequentially until it is in sync with the chunk again.
+    """
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    if jobs == 1 or len(source) < 2 * _MIN_CHUNK_SIZE:
+        return parser.Parser(source, path=path).parseSections()
+
+    boundaries = split(source, jobs * _CHUNKS_PER_JOB)
+    directives = [(match.start(), match.group(1).lower()) for match in _SEGMENT_RE.finditer(source)]
+
+    starts = boundaries[:-1]
+    ends = boundaries[1:]
+    segments = [guess_segment(source, directives, start) for start in starts]
+
+    # Unpickling the tokens allocates a lot of objects, which would trigger
+    # (pointless) garbage collections.
+    gc_enabled = gc.isenabled()
+    gc.disable()
+
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(source, path)) as executor:
+            chunks = list(executor.map(_parse_chunk_in_worker, starts, segments, ends))
+
+        return merge(source, chunks, path)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+def merge(source: str, chunks: list[Chunk], path: typing.Optional[str] = None) -> tuple[list, dict[str, int]]:
+    """
+    Merges the chunks of the input (in order) into the tokens and aliases of
+    the whole input.
+    """
+    tokens = []
+    alias_log = []
+
+    position = 0
+    segment = None
+
+    def append(chunk: Chunk, index: int):
+        if index < len(chunk.positions):
+            tokens.extend(chunk.tokens[chunk.token_starts[index]:])
+            alias_log.extend(chunk.aliases[chunk.alias_starts[index]:])
+
+        if chunk.error is not None:
+            raise chunk.error
+
+    for chunk in chunks:
+        if position >= chunk.stop and not chunk.ended:
+            # Already parsed while getting in sync with an earlier chunk
+            continue
+
+        if not chunk.positions and chunk.error is None:
+            # Nothing but whitespace and comments
+            if chunk.ended:
+                break
+
+            continue
+
+        index = bisect.bisect_left(chunk.positions, position)
+
+        if index == len(chunk.positions) or chunk.positions[index] != position or chunk.segments[index] != segment:
+            # Out of sync. Parse sequentially until a statement of the chunk
+            # (or the end of the chunk) is reached.
+            catch_up, index = parse_chunk(source, position, segment, chunk.stop, chunk, path)
+            append(catch_up, 0)
+
+            if index is None:
+                if catch_up.ended:
+                    break
+
+                position = catch_up.stop
+                segment = catch_up.stop_segment
+                continue
+
+        append(chunk, index)
+
+        if chunk.ended:
+            break
+
+        position = chunk.stop
+        segment = chunk.stop_segment
+
+    aliases = {}
+    for name, value in alias_log:
+        aliases[name] = value
+
+    return tokens, aliases
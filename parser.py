@@ -1,7 +1,220 @@
+import os
+import sys
 import typing
 import re
 
 import base
+import ir
+import lexer
+
+_VALUE_OR_LABEL = r"(?:-?\s*[0-9]+|\$[0-9a-fA-F]+|%[01]+|'..?'|\"..?\"|[a-zA-Z0-9_]+)"
+_REGISTER = r"(?:[rR][0-7]|SP|GB)"
+
+# The operand grammar. Every alternative is a group named after the addressing
+# mode it matches, so the mode can be read from 'lastgroup' after a single
+# match. The register indexed forms come before the indexed forms, since
+# register names are also valid labels.
+_OPERAND_RE = re.compile("|".join([
+    rf"(?P<AM_REGISTER>(?P<AM_REGISTER_reg>{_REGISTER}))",
+    rf"(?P<AM_REG_INDEXED>\[\s*(?P<AM_REG_INDEXED_reg>{_REGISTER})\s*\+\s*(?P<AM_REG_INDEXED_arg>{_REGISTER})\s*\])",
+    rf"(?P<AM_INDEXED>\[\s*(?P<AM_INDEXED_reg>{_REGISTER})\s*[\+-]\s*(?P<AM_INDEXED_arg>{_VALUE_OR_LABEL})\s*\])",
+    rf"(?P<AM_POST_INC>\[\s*(?P<AM_POST_INC_reg>{_REGISTER})\s*\+\+\s*\])",
+    rf"(?P<AM_PRE_DEC>\[\s*--\s*(?P<AM_PRE_DEC_reg>{_REGISTER})\s*\])",
+    rf"(?P<AM_IND_REG_INDEXED>\[\s*\[\s*(?P<AM_IND_REG_INDEXED_reg>{_REGISTER})\s*\]\s*\+\s*(?P<AM_IND_REG_INDEXED_arg>{_REGISTER})\s*\])",
+    rf"(?P<AM_IND_INDEXED>\[\s*\[\s*(?P<AM_IND_INDEXED_reg>{_REGISTER})\s*\]\s*[\+-]\s*(?P<AM_IND_INDEXED_arg>{_VALUE_OR_LABEL})\s*\])",
+    rf"(?P<AM_VALUE>{_VALUE_OR_LABEL})",
+]))
+
+# Maps the alternatives of _OPERAND_RE (except AM_VALUE) to their token type,
+# the group holding the register, the group holding the second field (if any)
+# and whether that second field is a register (or a displacement).
+_OPERAND_MODES = {
+    "AM_REGISTER":        (base.AM_REGISTER,        "AM_REGISTER_reg",        None,                     False),
+    "AM_REG_INDEXED":     (base.AM_REG_INDEXED,     "AM_REG_INDEXED_reg",     "AM_REG_INDEXED_arg",     True),
+    "AM_INDEXED":         (base.AM_INDEXED,         "AM_INDEXED_reg",         "AM_INDEXED_arg",         False),
+    "AM_POST_INC":        (base.AM_POST_INC,        "AM_POST_INC_reg",        None,                     False),
+    "AM_PRE_DEC":         (base.AM_PRE_DEC,         "AM_PRE_DEC_reg",         None,                     False),
+    "AM_IND_REG_INDEXED": (base.AM_IND_REG_INDEXED, "AM_IND_REG_INDEXED_reg", "AM_IND_REG_INDEXED_arg", True),
+    "AM_IND_INDEXED":     (base.AM_IND_INDEXED,     "AM_IND_INDEXED_reg",     "AM_IND_INDEXED_arg",     False),
+}
+
+# The kind of the statement markers yielded by Parser.iter_sections (if
+# requested). These never reach the assembler.
+STATEMENT_START = 0
+
+class AliasLog(dict):
+    """
+    An aliases dict that also logs every assignment, so the assignments can be
+    attributed to the statements that made them.
+    """
+    def __init__(self):
+        super().__init__()
+        self.log = []
+
+    def __setitem__(self, name: str, value: int):
+        super().__setitem__(name, value)
+        self.log.append((name, value))
+
+class IncludedFile(typing.NamedTuple):
+    """
+    The parsed contents of an included file.
+    """
+    tokens: list
+
+    # The assignments to the aliases, with the number of tokens before them
+    aliases: list[tuple[int, str, int]]
+
+    # The segment at the end of the file
+    segment: typing.Optional[str]
+
+    # The (path, modification time, size) of the file and of all files it
+    # includes, to check whether the parsed contents are still valid
+    dependencies: list[tuple[str, int, int]]
+
+    def iter_tokens(self, aliases: dict[str, int]) -> typing.Iterator:
+        """
+        Yields the tokens, and adds the aliases to the given dict, in the
+        order in which they were parsed. The tokens are resolved in place by
+        the assembler, so the instructions are copies.
+        """
+        start = 0
+
+        for end, name, value in self.aliases:
+            yield from self._copy_tokens(start, end)
+            start = end
+
+            aliases[name] = value
+
+        yield from self._copy_tokens(start, len(self.tokens))
+
+    def _copy_tokens(self, start: int, end: int) -> typing.Iterator:
+        for index in range(start, end):
+            token = self.tokens[index]
+
+            if isinstance(token, ir.Instruction):
+                token = token.copy()
+
+            yield token
+
+# The parsed included files of this process, by path and by the segment they
+# were included in. Libraries that are included by many programs (in a batch)
+# are parsed only once.
+_included_files: dict[tuple[str, typing.Optional[str]], IncludedFile] = {}
+
+def _signature(path: str) -> tuple[str, int, int]:
+    stat = os.stat(path)
+
+    return path, stat.st_mtime_ns, stat.st_size
+
+def is_up_to_date(dependencies: list[tuple[str, int, int]]) -> bool:
+    """
+    Returns whether none of the files in the dependencies (see IncludedFile)
+    changed.
+    """
+    try:
+        return all(_signature(dependency[0]) == dependency for dependency in dependencies)
+    except OSError:
+        return False
+
+def include_file(path: str, segment: typing.Optional[str], including: tuple[str, ...] = ()) -> IncludedFile:
+    """
+    Returns the parsed contents of the file at the (absolute) path, as included
+    in the given segment. including are the paths of the files that (directly
+    or indirectly) include it. The result is cached, until the file or any of
+    the files it includes changes.
+    """
+    if path in including:
+        raise ValueError(f"Recursive @INCLUDE of {path}")
+
+    key = (path, segment)
+    included = _included_files.get(key)
+
+    if included is not None and is_up_to_date(included.dependencies):
+        return included
+
+    # Before reading, so a change while reading is noticed the next time
+    signature = _signature(path)
+
+    with open(path, "r") as f:
+        source = f.read()
+
+    included_parser = Parser(source, path=path, including=including)
+    log = AliasLog()
+    tokens = []
+    aliases = []
+
+    for token in included_parser.iter_sections(log, segment):
+        while len(aliases) < len(log.log):
+            aliases.append((len(tokens), *log.log[len(aliases)]))
+
+        tokens.append(token)
+
+        if not isinstance(token, ir.Instruction):
+            if token[0] == base.CODE_SEGMENT_START:
+                segment = "code"
+            elif token[0] == base.DATA_SEGMENT_START:
+                segment = "data"
+
+    while len(aliases) < len(log.log):
+        aliases.append((len(tokens), *log.log[len(aliases)]))
+
+    included = IncludedFile(tokens, aliases, segment, [signature] + included_parser.dependencies)
+    _included_files[key] = included
+
+    return included
+
+def find_includes(source: typing.Union[str, bytes], path: typing.Optional[str] = None) -> list[str]:
+    """
+    Returns the paths of the files that the source (at the given path, if any)
+    includes, directly or indirectly. Only lexes the source, so it is much
+    faster than parsing it.
+    """
+    found = []
+    pending = [(source, path)]
+
+    while pending:
+        source, path = pending.pop()
+
+        # Most sources don't include anything
+        marker = "@INCLUDE" if isinstance(source, str) else b"@INCLUDE"
+        if source.find(marker) < 0:
+            continue
+
+        scanner = lexer.Lexer(source)
+
+        while (term := scanner.next_term()) is not None:
+            if term.text != "@INCLUDE" or (name := scanner.next_term()) is None:
+                continue
+
+            included_path = resolve_include(name.text, path)
+
+            if included_path in found:
+                continue
+
+            found.append(included_path)
+
+            try:
+                with open(included_path, "r") as f:
+                    pending.append((f.read(), included_path))
+            except OSError:
+                # Reported when the source is parsed
+                pass
+
+    return found
+
+def resolve_include(name: str, path: typing.Optional[str]) -> str:
+    """
+    Returns the absolute path of a file included as name (which may be quoted)
+    by the file at path. Relative names are relative to the directory of the
+    including file, or to the working directory if path is None.
+    """
+    if len(name) >= 2 and name[0] == name[-1] and name[0] in "'\"":
+        name = name[1:-1]
+
+    if path is not None:
+        name = os.path.join(os.path.dirname(path), name)
+
+    return os.path.abspath(name)
 
 class Segment:
     _content: list[tuple]
@@ -14,93 +227,88 @@ class Segment:
 
 
 class Parser:
-    def __init__(self, input_string):
+    def __init__(self, input_string, pos=0, path=None, including=()):
         """
-        Initialises the parser
+        Initialises the parser. Parsing starts at the given offset, which must
+        be the start of a statement (or 0). The input is a string, or bytes
+        (see lexer.Lexer).
+
+        path is the file the input was read from (if any), which included
+        files are relative to. including are the paths of the files that
+        include it, if it is an included file itself.
         """
         self.input = input_string
-        self.input_pos = 0
+        self.lexer = lexer.Lexer(input_string, pos)
+        self.path = path
+        self.including = including
 
-    def get_next_term(self, peek: bool = False, extra_delimiters: str = "", match_parentheses: bool = False) -> typing.Optional[str]:
+        # The signatures of the included files (see IncludedFile)
+        self.dependencies = []
+
+    def get_next_term(self, peek: bool = False) -> typing.Optional[str]:
         """
-        Returns the next non-comment space separated word (or any other delimiter).
-        If peek is set to True, the 'input_pos' will not be advanced. If
-        match_parentheses is set to True, square bracket parentheses will be
-        matched.
+        Returns the next non-comment term. If peek is set to True, the term is
+        not consumed. Returns None at the end of the input.
         """
-        pos = self.input_pos
-
-        # Loop to exit comment
-        while True:
-            # Skip until the first non-whitespace character, ie. not one of:
-            # ' ', '\n', '\t', '\r', '\f' and '\v'
-            while pos < len(self.input) and self.input[pos].isspace():
-                pos += 1
-
-            # Return None to signal end of file
-            if pos == len(self.input):
-                if not peek:
-                    self.input_pos = pos
+        if peek:
+            term = self.lexer.peek_term()
+        else:
+            term = self.lexer.next_term()
 
-                return None
-
-            if self.input[pos] != ";":
-                break
-
-            pos = 1 + self.input.find("\n", pos)
-
-            if pos == 0:  # No newline found - return None
-                if not peek:
-                    self.input_pos = pos
-
-                return None
+        if term is None:
+            return None
 
-        # Find the end of the word by finding the next whitespace character.
-        end_pos = pos
-        nesting = 0
-        while end_pos < len(self.input):
-            if self.input[end_pos] == "[":
-                nesting += 1
-            elif self.input[end_pos] == "]":
-                nesting -= 1
+        return term.text
 
-            if (not match_parentheses or nesting == 0) and (self.input[end_pos].isspace() or self.input[end_pos] == ";" or self.input[end_pos] in extra_delimiters):
-                break
-
-            end_pos += 1
+    def location(self) -> str:
+        """
+        Returns a description of the position of the last consumed term, for
+        use in error messages.
+        """
+        if self.including:
+            return f"{self.path}, line {self.lexer.line}, column {self.lexer.column}"
 
-        result = self.input[pos:end_pos]
+        return f"line {self.lexer.line}, column {self.lexer.column}"
 
-        if self.input[end_pos] in extra_delimiters:
-            end_pos += 1
+    def parseSections(self) -> tuple[list, dict[str, int]]:
+        """
+        Parses the whole input. Returns the tokens and the aliases.
+        """
+        aliases = {}
+        tokens = list(self.iter_sections(aliases))
 
-        # Update the input_pos value
-        if not peek:
-            self.input_pos = end_pos
+        return tokens, aliases
 
-        return result
+    def iter_sections(self, aliases: dict[str, int], segment: typing.Optional[str] = None, markers: bool = False) -> typing.Iterator:
+        """
+        Parses the input, yielding the tokens as soon as they are parsed. The
+        aliases (EQU values and sizes) are added to the given dict as soon as
+        they are parsed.
 
-    def parseSections(self) -> list:
-        # process the file line by line
-        segment = None  # 'code', 'data' or None
-        aliases = {}
-        tokens = []
+        segment is the segment the parser starts in. If markers is set, a
+        (STATEMENT_START, offset, end offset of the first term, segment) token
+        is yielded before the tokens of every statement.
+        """
+        # segment is 'code', 'data' or None
 
         # Tokenise based on spaces
         while (term := self.get_next_term()) is not None:
 
+            if markers:
+                yield (STATEMENT_START, self.lexer.pos, self.lexer.pos + len(term), segment)
+
             if term == "@CODE":
                 if self.get_next_term(peek=True) == "=":
                     self.get_next_term()  # To consume the '='
 
                     term = self.get_next_term()
-                    address = self.get_value(self.get_next_term())
+                    address = self.get_value(term)
                     if address is None:
-                        raise ValueError(f"Expected a number literal after '@CODE =' - got {term!r}")
+                        raise ValueError(f"Expected a number literal after '@CODE =' - got {term!r} ({self.location()})")
                 else:
                     address = 0x3ffff
 
-                tokens.append((base.Token.CODE_SEGMENT_START, address))
+                yield (base.CODE_SEGMENT_START, address)
                 segment = "code"
 
             elif term == "@DATA":
@@ -110,16 +318,22 @@ class Parser:
                     term = self.get_next_term()
                     address = self.get_value(term)
                     if address is None:
-                        raise ValueError(f"Expected a number literal after '@DATA =' - got {term!r}")
+                        raise ValueError(f"Expected a number literal after '@DATA =' - got {term!r} ({self.location()})")
                 else:
                     address = 0x3ffff
 
-                tokens.append((base.Token.DATA_SEGMENT_START, address))
+                yield (base.DATA_SEGMENT_START, address)
                 segment = "data"
 
             elif term == "@END":
                 break
-            elif term in {"@STACK", "@STACKSIZE", "@INCLUDE"}:
+            elif term == "@INCLUDE":
+                included = self.include(segment)
+
+                yield from included.iter_tokens(aliases)
+                segment = included.segment
+
+            elif term in {"@STACK", "@STACKSIZE"}:
                 raise NotImplementedError(f"Statement {term} is not supported.")
 
             elif self.get_next_term(peek=True) == "EQU":
@@ -129,7 +343,7 @@ class Parser:
                 value = self.get_value(value_term)
 
                 if value is None:
-                    raise ValueError(f"Expected a number literal after '{term} EQU' - got {value_term!r}")
+                    raise ValueError(f"Expected a number literal after '{term} EQU' - got {value_term!r} ({self.location()})")
 
                 aliases[term] = value
 
@@ -142,13 +356,21 @@ class Parser:
 
                 if op == "DW":
                     # Define some words
-                    tokens.append((base.Token.LABEL, label))
+                    yield (base.LABEL, label)
 
                     count = 0
 
-                    while (value := self.get_value(self.get_next_term(peek=True, extra_delimiters=","))) is not None:
-                        self.get_next_term(extra_delimiters=",")  # to consume the value
-                        tokens.append((base.Token.DATA, value))
+                    # The values may be separated by commas
+                    while (value_term := self.get_next_term(peek=True)) is not None:
+                        if value_term == ",":
+                            self.get_next_term()  # to consume the ','
+                            continue
+
+                        if (value := self.get_value(value_term)) is None:
+                            break
+
+                        self.get_next_term()  # to consume the value
+                        yield (base.DATA, value, 1)
                         count += 1
 
                     # Improvement: add sizeof(<label>) as an implicit EQU
@@ -156,163 +378,160 @@ class Parser:
 
                 elif op == "DS":
                     # Define an array ("storage")
-                    tokens.append((base.Token.LABEL, label))
-                    size = self.get_value(self.get_next_term())
+                    yield (base.LABEL, label)
+                    size_term = self.get_next_term()
+                    size = self.get_value(size_term)
 
-                    for _ in range(size):
-                        tokens.append((base.Token.DATA, 0))
+                    if size is None:
+                        raise ValueError(f"Expected a number literal after '{label} DS' - got {size_term!r} ({self.location()})")
+
+                    # A single run of zeroes
+                    yield (base.DATA, 0, size)
 
                     # Improvement: add sizeof(<label>) as an implicit EQU
                     aliases[f"sizeof({label})"] = size
 
                 else:
-                    raise ValueError(f"Unknown data definition type: {op!r}")
+                    raise ValueError(f"Unknown data definition type: {op!r} ({self.location()})")
 
             elif segment == "code":
                 # check if this is a label
                 if term.endswith(":"):
                     label = term.removesuffix(":")
-                    tokens.append((base.Token.LABEL, label))
+                    yield (base.LABEL, label)
                 else:
                     # Mnemonics are case-insensitive
                     mnemonic = term.upper()
 
-                    for operands_count in base.Instructions:
-                        if mnemonic in base.Instructions[operands_count]:
-                            break
-                    else:
-                        raise ValueError(f"Unknown mnemonic {term!r} encountered.")
+                    info = base.InstructionSet.get(mnemonic)
+
+                    if info is None:
+                        raise ValueError(f"Unknown mnemonic {term!r} encountered ({self.location()}).")
+
+                    operands_count = len(info.operands)
 
                     operands = []
                     for i in range(operands_count):
-                        operands.append(self.get_next_term(match_parentheses=True))
+                        # The operands may be separated by a comma
+                        if i > 0 and self.get_next_term(peek=True) == ",":
+                            self.get_next_term()  # to consume the ','
+
+                        if (operand := self.get_next_term()) is None:
+                            raise ValueError(f"Unexpected end of input in operands of {mnemonic} ({self.location()})")
+
+                        operands.append(operand)
 
                     parsed_ops = self.parse_operands(operands)
 
                     mnemonic, parsed_ops = self.handle_simplified_mnemonics(mnemonic, parsed_ops)
 
-                    expected_types = base.InstructionOperands[mnemonic]
+                    expected_masks = base.InstructionOperandMasks[mnemonic]
 
-                    for (got, *_), expected in zip(parsed_ops, expected_types):
-                        if got not in expected:
-                            raise ValueError(f"Invalid operand types. Expected operand types {expected_types}, got {parsed_ops}.")
+                    for operand, expected in zip(parsed_ops, expected_masks):
+                        if not operand.mode & expected:
+                            expected_types = base.InstructionOperands[mnemonic]
+                            raise ValueError(f"Invalid operand types. Expected operand types {expected_types}, got {parsed_ops} ({self.location()}).")
 
                     # Add the line to the segment
-                    tokens.append((base.Token.MNEMONIC, mnemonic, parsed_ops))
+                    yield ir.Instruction(mnemonic, parsed_ops)
 
             else:
-                raise ValueError(f"Term {term!r} outside segment - segment is {segment}")
+                raise ValueError(f"Term {term!r} outside segment - segment is {segment} ({self.location()})")
 
-        return tokens, aliases
+    def include(self, segment: typing.Optional[str]) -> IncludedFile:
+        """
+        Parses the file name after '@INCLUDE', and returns the parsed contents
+        of that file, included in the given segment (see include_file). An
+        @END statement in an included file only ends that file.
+        """
+        name = self.get_next_term()
+
+        if name is None:
+            raise ValueError(f"Expected a file name after '@INCLUDE' ({self.location()})")
 
-    def handle_simplified_mnemonics(self, mnemonic: str, parsed_ops: list) -> tuple[str, list]:
+        path = resolve_include(name, self.path)
+
+        including = self.including
+        if self.path is not None:
+            # Absolute, like the paths of resolve_include
+            including += (os.path.abspath(self.path),)
+
+        try:
+            included = include_file(path, segment, including)
+        except OSError as e:
+            raise ValueError(f"Cannot include {name}: {e.strerror} ({self.location()})") from e
+
+        self.dependencies.extend(included.dependencies)
+
+        return included
+
+    def handle_simplified_mnemonics(self, mnemonic: str, parsed_ops: list[ir.Operand]) -> tuple[str, list[ir.Operand]]:
         """
         This function translates the simplified mnemonic into their full form.
         """
         if mnemonic == "RTS":
             # JMP [SP++] -> JMP [r7++]
-            return "JMP", [(base.Token.AM_POST_INC, 7)]
+            return "JMP", [ir.Operand(base.AM_POST_INC, 7)]
 
         if mnemonic == "PUSH":
-            if parsed_ops[0][0] != base.Token.AM_REGISTER:
+            if parsed_ops[0].mode != base.AM_REGISTER:
                 raise ValueError(f"PUSH instruction takes a register operand - got {parsed_ops}")
 
             # STOR rX, [--SP] -> STOR rX, [--r7]
-            return "STOR", [parsed_ops[0], (base.Token.AM_PRE_DEC, 7)]
+            return "STOR", [parsed_ops[0], ir.Operand(base.AM_PRE_DEC, 7)]
 
         if mnemonic == "PULL":
-            if parsed_ops[0][0] != base.Token.AM_REGISTER:
+            if parsed_ops[0].mode != base.AM_REGISTER:
                 raise ValueError(f"PULL instruction takes a register operand - got {parsed_ops}")
 
             # LOAD rX, [SP++] -> LOAD rX, [r7++]
-            return "LOAD", [parsed_ops[0], (base.Token.AM_POST_INC, 7)]
+            return "LOAD", [parsed_ops[0], ir.Operand(base.AM_POST_INC, 7)]
 
         return mnemonic, parsed_ops
 
-    def parse_operands(self, operands: list[str]) -> list[typing.Union[tuple[base.Token, typing.Union[int, str]], tuple[base.Token, int, int]]]:
+    def parse_operands(self, operands: list[str]) -> list[ir.Operand]:
         """
-        Given a list of operands, returns a list of tokenised operands.
+        Given a list of operands, returns a list of parsed operands.
         """
-
-        value_or_label = r"((?:-?\s*[0-9]+)|(?:\$[0-9a-fA-F]+)|(?:%[01]+)|(?:'..?')|(?:\"..?\")|(?:[a-zA-Z0-9_]+))"
-        register = r"((?:[rR][0-7])|SP|GB)"
-
-        value_re = re.compile(value_or_label)
-        register_re = re.compile(register)
-
-        indexed_re = re.compile(r"\s*".join([r"\[", register, r"[\+-]", value_or_label, r"\]"]))
-        reg_indexed_re = re.compile(r"\s*".join([r"\[", register, r"\+", register, r"\]"]))
-        post_inc_re = re.compile(r"\s*".join([r"\[", register, r"\+\+", r"\]"]))
-        pre_dec_re = re.compile(r"\s*".join([r"\[", r"--", register, r"\]"]))
-        ind_indexed_re = re.compile(r"\s*".join([r"\[", r"\[", register, r"\]", r"[\+-]", value_or_label, r"\]"]))
-        ind_reg_indexed_re = re.compile(r"\s*".join([r"\[", r"\[", register, r"\]", r"\+", register, r"\]"]))
-
         tokens = []
 
         for operand in operands:
             name = operand.strip()
+            m = _OPERAND_RE.fullmatch(name)
 
-            if register_re.fullmatch(name):
-                n = self.get_reg(name)
-
-                tokens.append((base.Token.AM_REGISTER, n))
-            elif (m := reg_indexed_re.fullmatch(name)):
-                reg0, reg1 = m.groups()
+            if m is None:  # must be a label
+                print(f"Warning: Unknown operand thing: {name!r} - assuming it's a label", file=sys.stderr)
+                tokens.append(ir.Operand(base.AM_LABEL, value=name))
+                continue
 
-                reg0 = self.get_reg(reg0)
-                reg1 = self.get_reg(reg1)
-
-                tokens.append((base.Token.AM_REG_INDEXED, reg0, reg1))
-            elif (m := indexed_re.fullmatch(name)):
-                reg, disp = m.groups()
-
-                reg = self.get_reg(reg)
-                res = self.get_value(disp)
+            mode = m.lastgroup
 
-                # If disp is a label, it cannot be resolved, so keep the string
-                if res is not None:
-                    disp = res
+            if mode == "AM_VALUE":
+                n = self.get_value(name)
 
-                tokens.append((base.Token.AM_INDEXED, reg, disp))
-            elif (m := post_inc_re.fullmatch(name)):
-                reg, = m.groups()
-                reg = self.get_reg(reg)
+                if n is not None:
+                    tokens.append(ir.Operand(base.AM_VALUE, value=n))
+                else:
+                    tokens.append(ir.Operand(base.AM_LABEL, value=name))
 
-                tokens.append((base.Token.AM_POST_INC, reg))
-            elif (m := pre_dec_re.fullmatch(name)):
-                reg, = m.groups()
-                reg = self.get_reg(reg)
+                continue
 
-                tokens.append((base.Token.AM_PRE_DEC, reg))
-            elif (m := ind_indexed_re.fullmatch(name)):
-                reg, disp = m.groups()
+            type_, reg_group, arg_group, arg_is_reg = _OPERAND_MODES[mode]
+            reg = self.get_reg(m.group(reg_group))
 
-                reg = self.get_reg(reg)
+            if arg_group is None:
+                tokens.append(ir.Operand(type_, reg))
+            elif arg_is_reg:
+                tokens.append(ir.Operand(type_, reg, self.get_reg(m.group(arg_group))))
+            else:
+                disp = m.group(arg_group)
                 res = self.get_value(disp)
 
                 # If disp is a label, it cannot be resolved, so keep the string
                 if res is not None:
                     disp = res
 
-                tokens.append((base.Token.AM_IND_INDEXED, reg, disp))
-            elif (m := ind_reg_indexed_re.fullmatch(name)):
-                reg0, reg1 = m.groups()
-
-                reg0 = self.get_reg(reg0)
-                reg1 = self.get_reg(reg1)
-
-                tokens.append((base.Token.AM_IND_REG_INDEXED, reg0, reg1))
-            elif value_re.fullmatch(name):
-                n = self.get_value(name)
-
-                if n is not None:
-                    tokens.append((base.Token.AM_VALUE, n))
-                else:
-                    tokens.append((base.Token.AM_LABEL, name))
-
-            else:  # must be a label
-                print(f"Warning: Unknown operand thing: {name!r} - assuming it's a label")
-                tokens.append((base.Token.AM_LABEL, name))
+                tokens.append(ir.Operand(type_, reg, disp))
 
         return tokens
 
@@ -0,0 +1,67 @@
+class FenwickTree:
+    """
+    A Fenwick tree (binary indexed tree) over a list of integer counters that
+    are initially zero. Adding to a counter and summing a prefix of the counters
+    both take O(log n) time.
+    """
+    __slots__ = ("_tree",)
+
+    def __init__(self, size: int):
+        self._tree = [0] * (size + 1)
+
+    def add(self, index: int, delta: int):
+        """
+        Adds delta to the counter at the given index.
+        """
+        tree = self._tree
+        size = len(tree)
+        index += 1
+
+        while index < size:
+            tree[index] += delta
+            index += index & -index
+
+    def prefix_sum(self, end: int) -> int:
+        """
+        Returns the sum of the counters with an index below end.
+        """
+        tree = self._tree
+        total = 0
+
+        while end > 0:
+            total += tree[end]
+            end &= end - 1
+
+        return total
+
+
+class ShiftedAliases:
+    """
+    A read-only view of the aliases during relaxation. The label values are
+    corrected for the instructions (before the label) that have been shortened
+    so far, so the aliases themselves never have to be updated.
+    """
+    __slots__ = ("_aliases", "_label_positions", "_shortened")
+
+    def __init__(self, aliases: dict[str, int], label_positions: dict[str, int], shortened: FenwickTree):
+        """
+        label_positions maps every label to the number of instructions before
+        it. shortened has a counter for every instruction, which is 1 if the
+        instruction was shortened.
+        """
+        self._aliases = aliases
+        self._label_positions = label_positions
+        self._shortened = shortened
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._aliases
+
+    def __getitem__(self, name: str) -> int:
+        value = self._aliases[name]
+        position = self._label_positions.get(name)
+
+        if position is not None:
+            value -= self._shortened.prefix_sum(position)
+
+        return value
+
@@ -0,0 +1,216 @@
+import io
+import json
+import os
+import socketserver
+import stat
+import sys
+import typing
+
+import assembler
+import sockets
+
+# JSON-RPC 2.0 error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+ASSEMBLY_ERROR = -32000
+
+class RequestError(Exception):
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+
+def assemble(params: dict) -> dict:
+    """
+    The assemble method. Assembles either the given source (returning the hex
+    file as "hex") or the file at the given path (writing the hex file to the
+    given output, or next to the input). @INCLUDE paths are relative to the
+    path, also when the source is given. With "listing" set, the listing is
+    returned as well.
+    """
+    one_pass = bool(params.get("one_pass", False))
+    want_listing = bool(params.get("listing", False))
+
+    path = params.get("path")
+    if path is not None and not isinstance(path, str):
+        raise RequestError(INVALID_PARAMS, "The path must be a string")
+
+    if "source" in params:
+        source = params["source"]
+        output = None
+    elif path is not None:
+        with open(path, 'r') as f:
+            source = f.read()
+
+        output = params.get("output")
+        if output is None:
+            name, _ = os.path.splitext(path)
+            output = name + ".hex"
+    else:
+        raise RequestError(INVALID_PARAMS, "Expected a source or a path")
+
+    if not isinstance(source, str):
+        raise RequestError(INVALID_PARAMS, "The source must be a string")
+
+    # A listing is kept for verbose assemblers, but assemble_source never
+    # prints it
+    asm = assembler.Assembler(path, output, want_listing, one_pass)
+    image = asm.assemble_source(source)
+
+    result = {
+        "code_size": image.code.size,
+        "data_size": image.data.size,
+        "stack_size": image.stack.size,
+    }
+
+    if output is None:
+        result["hex"] = image.to_hex()
+    else:
+        asm.write_output(image.code, image.data, image.stack, output)
+        result["output"] = output
+
+    if want_listing:
+        f = io.StringIO()
+        asm.write_listing(image.code, f)
+        result["listing"] = f.getvalue()
+
+    return result
+
+def ping(params: dict) -> str:
+    return "pong"
+
+def shutdown(params: dict) -> None:
+    """
+    The shutdown method. Stops the server after the response is sent (see
+    serve_stream).
+    """
+    return None
+
+METHODS = {
+    "assemble": assemble,
+    "ping": ping,
+    "shutdown": shutdown,
+}
+
+def handle_line(line: bytes) -> tuple[typing.Optional[dict], bool]:
+    """
+    Handles a single JSON-RPC request. Returns the response (or None for
+    notifications, which have no id), and whether the request asked the server
+    to shut down.
+    """
+    request_id = None
+    shutdown_requested = False
+
+    try:
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            raise RequestError(PARSE_ERROR, f"Invalid JSON: {e}")
+
+        if not isinstance(request, dict) or not isinstance(request.get("method"), str):
+            raise RequestError(INVALID_REQUEST, "Expected an object with a method")
+
+        request_id = request.get("id")
+        method = METHODS.get(request["method"])
+
+        if method is None:
+            raise RequestError(METHOD_NOT_FOUND, f"Unknown method {request['method']}")
+
+        params = request.get("params", {})
+        if not isinstance(params, dict):
+            raise RequestError(INVALID_PARAMS, "The params must be an object")
+
+        shutdown_requested = method is shutdown
+
+        try:
+            result = method(params)
+        except RequestError:
+            raise
+        except Exception as e:
+            raise RequestError(ASSEMBLY_ERROR, f"{type(e).__name__}: {e}")
+
+        if "id" not in request:
+            return None, shutdown_requested
+
+        return {"jsonrpc": "2.0", "id": request_id, "result": result}, shutdown_requested
+
+    except RequestError as e:
+        return {"jsonrpc": "2.0", "id": request_id, "error": {"code": e.code, "message": str(e)}}, shutdown_requested
+
+def serve_stream(reader: typing.BinaryIO, writer: typing.BinaryIO) -> bool:
+    """
+    Handles requests, one JSON object per line, until the reader is exhausted
+    or a shutdown request arrives. Returns whether a shutdown was requested.
+    """
+    for line in reader:
+        if not line.strip():
+            continue
+
+        response, shutdown_requested = handle_line(line)
+
+        if response is not None:
+            writer.write(json.dumps(response).encode() + b"\n")
+            writer.flush()
+
+        if shutdown_requested:
+            return True
+
+    return False
+
+def serve_stdio():
+    """
+    Serves requests on stdin, writing the responses to stdout.
+    """
+    serve_stream(sys.stdin.buffer, sys.stdout.buffer)
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        if serve_stream(self.rfile, self.wfile):
+            # shutdown() waits for serve_forever to return, which happens in
+            # another thread
+            self.server.shutdown()
+
+def serve_unix(socket_path: typing.Optional[str] = None):
+    """
+    Serves requests on a Unix socket (sockets.default_socket() by default),
+    with a thread per connection. Only the user can connect to the socket. A
+    stale socket is replaced, but anything else at its path is left alone.
+    """
+    if socket_path is None:
+        socket_path = sockets.default_socket()
+        _make_private_directory(os.path.dirname(socket_path))
+
+    if os.path.exists(socket_path):
+        if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+            raise FileExistsError(f"{socket_path} exists and is not a socket")
+
+        os.remove(socket_path)
+
+    # Create the socket with permissions 0600, instead of changing them after
+    # others could have connected
+    previous_umask = os.umask(0o177)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(socket_path, _Handler)
+    finally:
+        os.umask(previous_umask)
+
+    with server:
+        server.daemon_threads = True
+
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(socket_path)
+
+def _make_private_directory(path: str):
+    """
+    Creates a directory that only the user can access, if it doesn't exist.
+    Raises PermissionError if it exists but others can access it (or replace
+    the socket in it).
+    """
+    os.makedirs(path, 0o700, exist_ok=True)
+
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise PermissionError(f"{path} must be a directory that only you can access")
@@ -0,0 +1,17 @@
+# The Unix socket that the assembler server listens on (see server.py)
+#
+# Kept apart from server.py and client.py, so that main.py can show the default
+# in its help without importing either of them.
+import os
+
+def default_socket() -> str:
+    """
+    Returns the Unix socket used when none is given. It is in a directory that
+    only the user can access: $XDG_RUNTIME_DIR, or else a directory of the user
+    in /tmp, which the server creates.
+    """
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "pp2-assembler.sock")
+
+    return os.path.join("/tmp", f"pp2-assembler-{os.getuid()}", "server.sock")
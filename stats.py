@@ -0,0 +1,72 @@
+import contextlib
+import json
+import time
+import tracemalloc
+import typing
+
+class Stats:
+    """
+    Wall time and (optionally) peak memory per phase of an assembly, and
+    counters such as the number of tokens parsed. A phase that runs more than
+    once accumulates its time, and keeps the highest peak.
+    """
+    def __init__(self, trace_memory: bool = False):
+        """
+        If trace_memory is set, the peak memory of every phase is measured with
+        tracemalloc. Note that tracing memory slows everything down.
+        """
+        self.trace_memory = trace_memory
+        self.phases = {}  # phase name -> {"time": seconds, "peak_memory": bytes}
+        self.counters = {}
+        self.cached_build = None  # the stats of the build a cached output came from
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> typing.Iterator[None]:
+        """
+        Context manager that measures a phase. Phases must not be nested.
+        """
+        started_tracing = False
+
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+
+            tracemalloc.reset_peak()
+
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            phase = self.phases.setdefault(name, {"time": 0.0})
+            phase["time"] += elapsed
+
+            if self.trace_memory:
+                _, peak = tracemalloc.get_traced_memory()
+                phase["peak_memory"] = max(peak, phase.get("peak_memory", 0))
+
+                if started_tracing:
+                    tracemalloc.stop()
+
+    def count(self, name: str, n: int = 1):
+        """
+        Adds n to the counter with the given name.
+        """
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def to_dict(self) -> dict:
+        result = {
+            "phases": self.phases,
+            "counters": self.counters,
+            "total_time": sum(phase["time"] for phase in self.phases.values()),
+        }
+
+        if self.cached_build is not None:
+            result["cached_build"] = self.cached_build
+
+        return result
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
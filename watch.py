@@ -0,0 +1,193 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+import typing
+
+import assembler
+import incremental
+
+# inotify constants, see inotify(7)
+_IN_MODIFY = 0x002
+_IN_CLOSE_WRITE = 0x008
+_IN_MOVED_TO = 0x080
+_IN_CREATE = 0x100
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+
+_EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+class InotifyWatcher:
+    """
+    Waits for changes of a file with inotify (Linux only). The directory is
+    watched rather than the file itself, since editors often save by writing a
+    new file and renaming it over the old one.
+    """
+    def __init__(self, path: str):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+        self.fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        directory, self.name = os.path.split(os.path.abspath(path))
+        mask = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+
+        self.name = os.fsencode(self.name)
+
+    def wait(self, timeout: typing.Optional[float] = None) -> bool:
+        """
+        Waits until the file changes or the timeout (in seconds) expires.
+        Returns whether the file changed.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            readable, _, _ = select.select([self.fd], [], [], remaining)
+
+            if not readable:
+                return False
+
+            if self._read_events():
+                return True
+
+    def _read_events(self) -> bool:
+        """
+        Reads all pending events, and returns whether any was about the file.
+        """
+        changed = False
+
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return False
+
+        offset = 0
+        while offset < len(data):
+            _, _, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+
+            if name == self.name:
+                changed = True
+
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingWatcher:
+    """
+    Waits for changes of a file by checking its modification time, size and
+    inode every interval seconds.
+    """
+    def __init__(self, path: str, interval: float = 0.2):
+        self.path = path
+        self.interval = interval
+        self.state = self._state()
+
+    def _state(self) -> typing.Optional[tuple]:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def wait(self, timeout: typing.Optional[float] = None) -> bool:
+        """
+        Waits until the file changes or the timeout (in seconds) expires.
+        Returns whether the file changed.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            state = self._state()
+
+            if state != self.state:
+                self.state = state
+                return True
+
+            if deadline is None:
+                time.sleep(self.interval)
+            else:
+                remaining = deadline - time.monotonic()
+
+                if remaining <= 0:
+                    return False
+
+                time.sleep(min(self.interval, remaining))
+
+    def close(self):
+        pass
+
+def create_watcher(path: str) -> typing.Union[InotifyWatcher, PollingWatcher]:
+    """
+    Returns an inotify watcher where available, and a polling one otherwise.
+    """
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(path)
+        except (OSError, AttributeError):
+            # No libc, or no inotify in it
+            pass
+
+    return PollingWatcher(path)
+
+def watch(asm: assembler.Assembler, debounce: float = 0.1, log: typing.TextIO = sys.stderr):
+    """
+    Assembles the input of the assembler, and then again every time the input
+    changes, until interrupted. The parsed statements of the previous version
+    are reused (see incremental.IncrementalAssembler). A change is handled once
+    the file has not changed for debounce seconds, so a save that takes several
+    writes is only assembled once.
+    """
+    builder = incremental.IncrementalAssembler(asm)
+    watcher = create_watcher(asm.input)
+
+    try:
+        while True:
+            start = time.perf_counter()
+
+            try:
+                with open(asm.input, 'r') as f:
+                    content = f.read()
+
+                image = builder.assemble_source(content)
+                asm.write_output(image.code, image.data, image.stack, asm.output)
+
+                if asm.verbose:
+                    asm.write_listing(image.code, sys.stdout)
+
+                if asm.listing is not None:
+                    with open(asm.listing, "w") as f:
+                        asm.write_listing(image.code, f)
+
+                elapsed = time.perf_counter() - start
+                log.write(f"assembled {asm.input} -> {asm.output} in {elapsed * 1000:.1f} ms\n")
+
+            except Exception as e:
+                log.write(f"error: {type(e).__name__}: {e}\n")
+
+            log.flush()
+
+            # Wait for a change, and then until the changes stop
+            watcher.wait()
+            while watcher.wait(debounce):
+                pass
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        watcher.close()